@@ -0,0 +1,68 @@
+"""
+Compares size and encode/decode speed of frontier requests with and without the payload codec
+(FRONTERA_SCHEDULER_PAYLOAD_CODEC). Size is measured as the pickled size of each frontier request fields,
+as an approximation of what a backend stores. From the repository root::
+
+    PYTHONPATH=. python benchmarks/bench_codec.py --output results.json
+"""
+import argparse
+import json
+import pickle
+import sys
+
+from bench_hotpaths import get_scheduler, make_request, measure
+
+
+def make_requests(spider, n, body_size):
+    body = b'{"query": "scrapy", "page": 1, "filters": [' + b'"category",' * (body_size // 11) + b'"x"]}'
+    return [make_request(i, method='POST', body=body, callback=spider.parse_item, errback=spider.errback,
+                         meta={'cf_store': True, 'item_id': i, 'category': 'books', 'tags': ['a', 'b', 'c']})
+            for i in range(n)]
+
+
+def frontier_size(frontier_request):
+    return len(pickle.dumps((frontier_request.url, frontier_request.method, frontier_request.headers,
+                             frontier_request.cookies, frontier_request.meta)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Write results as json to the given file')
+    parser.add_argument('--requests', type=int, default=10000, help='Number of requests per benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs of each benchmark')
+    args = parser.parse_args()
+
+    results = []
+    for body_size in (0, 4096):
+        for codec in (False, True):
+            scheduler = get_scheduler({'FRONTERA_SCHEDULER_PAYLOAD_CODEC': codec})
+            converter = scheduler.frontier.request_converter
+            requests = make_requests(scheduler.spider, args.requests, body_size)
+            frontier_requests = [converter.to_frontier(r) for r in requests]
+            label = '{} layout, {} bytes body'.format('codec' if codec else 'default', body_size)
+            # requests are built anew for every encode run, so fingerprints are not cached
+            encode = measure('encode ({})'.format(label),
+                             (lambda: make_requests(scheduler.spider, args.requests, body_size),
+                              lambda requests: [converter.to_frontier(r) for r in requests]),
+                             args.requests, args.repeat)
+            decode = measure('decode ({})'.format(label),
+                             (None, lambda: [converter.from_frontier(r) for r in frontier_requests]),
+                             args.requests, args.repeat)
+            size = sum(frontier_size(r) for r in frontier_requests) / len(frontier_requests)
+            print('{:<50} {:>14,.0f} bytes/request'.format('size ({})'.format(label), size), file=sys.stderr)
+            results.append({
+                'codec': codec,
+                'body_size': body_size,
+                'bytes_per_request': size,
+                'encode': encode,
+                'decode': decode,
+            })
+            scheduler.frontier.stop()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+Offline benchmarks of scrapy-frontera hot paths.
+
+Runs against the frontera in-memory FIFO backend and a mock downloader, so no network is needed. Reports
+operations per second and peak allocated bytes per operation for each benchmark, and optionally writes the
+results as json, so they can be compared between versions. From the repository root::
+
+    PYTHONPATH=. python benchmarks/bench_hotpaths.py --output results.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from unittest.mock import Mock
+
+import frontera
+import scrapy
+from scrapy import Request, Spider
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+import scrapy_frontera
+from scrapy_frontera.scheduler import FronteraScheduler
+
+
+BENCH_SETTINGS = {
+    'SCHEDULER': 'scrapy_frontera.scheduler.FronteraScheduler',
+    'BACKEND': 'frontera.contrib.backends.memory.FIFO',
+    'LOG_ENABLED': False,
+}
+
+
+class BenchSpider(Spider):
+    name = 'bench'
+
+    def parse(self, response):
+        pass
+
+    def parse_item(self, response):
+        pass
+
+    def errback(self, failure):
+        pass
+
+
+def get_scheduler(settings=None):
+    crawler_settings = Settings()
+    crawler_settings.setdict(BENCH_SETTINGS, priority='cmdline')
+    crawler_settings.setdict(settings or {}, priority='cmdline')
+    crawler = get_crawler(BenchSpider, crawler_settings)
+    crawler.engine = Mock()
+    crawler.engine.downloader.slots = {}
+    crawler.engine.downloader.ip_concurrency = 0
+    spider = BenchSpider.from_crawler(crawler)
+    crawler.spider = spider
+    scheduler = FronteraScheduler.from_crawler(crawler)
+    scheduler.open(spider)
+    return scheduler
+
+
+def make_request(i, **kwargs):
+    kwargs.setdefault('meta', {'cf_store': True, 'item_id': i})
+    return Request('http://example.com/page/{}?q=scrapy'.format(i), headers={'Referer': 'http://example.com'}, **kwargs)
+
+
+def measure(name, bench, ops, repeat):
+    """
+    bench is a (setup, func) pair, where func performs ops operations. setup, if not None, is called before every run
+    without being measured, and its result is passed to func, so each run works on fresh objects (for instance,
+    requests without cached fingerprints). If func returns a float, it is taken as the elapsed time of the measured
+    section. Timing and allocations are measured in separate runs, as tracing allocations slows down execution.
+    """
+    setup, func = bench
+
+    def get_args():
+        return () if setup is None else (setup(),)
+
+    func(*get_args())  # warm up
+    seconds = float('inf')
+    for _ in range(repeat):
+        args = get_args()
+        start = time.perf_counter()
+        elapsed = func(*args)
+        if not isinstance(elapsed, float):
+            elapsed = time.perf_counter() - start
+        seconds = min(seconds, elapsed)
+    args = get_args()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {
+        'name': name,
+        'ops': ops,
+        'seconds': seconds,
+        'ops_per_sec': ops / seconds if seconds else None,
+        'alloc_peak_bytes_per_op': peak / ops,
+    }
+    print('{name:<50} {ops_per_sec:>14,.0f} ops/s {alloc_peak_bytes_per_op:>10,.0f} B/op'.format(**result),
+          file=sys.stderr)
+    return result
+
+
+def bench_request_to_frontier(scheduler, n):
+    converter = scheduler.frontier.request_converter
+
+    def setup():
+        return [make_request(i, callback=scheduler.spider.parse_item, errback=scheduler.spider.errback)
+                for i in range(n)]
+    return setup, lambda requests: [converter.to_frontier(r) for r in requests]
+
+
+def bench_request_to_frontier_cached(scheduler, n):
+    """Same requests converted on every run, so fingerprints are taken from the converter cache"""
+    converter = scheduler.frontier.request_converter
+    requests = [make_request(i, callback=scheduler.spider.parse_item, errback=scheduler.spider.errback)
+                for i in range(n)]
+    return None, lambda: [converter.to_frontier(r) for r in requests]
+
+
+def bench_request_to_frontier_many(scheduler, n):
+    converter = scheduler.frontier.request_converter
+
+    def setup():
+        return [make_request(i, callback=scheduler.spider.parse_item, errback=scheduler.spider.errback)
+                for i in range(n)]
+    return setup, converter.to_frontier_many
+
+
+def bench_request_to_frontier_dont_filter(scheduler, n):
+    converter = scheduler.frontier.request_converter
+
+    def setup():
+        return [make_request(i, callback=scheduler.spider.parse_item, dont_filter=True) for i in range(n)]
+    return setup, lambda requests: [converter.to_frontier(r) for r in requests]
+
+
+def bench_request_from_frontier(scheduler, n):
+    converter = scheduler.frontier.request_converter
+    frontier_requests = [converter.to_frontier(make_request(i, callback=scheduler.spider.parse_item))
+                         for i in range(n)]
+    return None, lambda: [converter.from_frontier(r) for r in frontier_requests]
+
+
+def bench_response_to_frontier(scheduler, n):
+    converter = scheduler.frontier.response_converter
+    body = b'<html><body>' + b'<a href="/page">page</a>' * 1000 + b'</body></html>'
+
+    def setup():
+        return [HtmlResponse(url=r.url, body=body, request=r) for r in (make_request(i) for i in range(n))]
+    return setup, lambda responses: [converter.to_frontier(r) for r in responses]
+
+
+def bench_process_spider_output(scheduler, pages, links_per_page):
+    def setup():
+        responses = [HtmlResponse(url='http://example.com/hub/{}'.format(i), body=b'<html></html>',
+                                  request=make_request(i)) for i in range(pages)]
+        links = [make_request(i, callback=scheduler.spider.parse_item) for i in range(links_per_page)]
+        return responses, links
+
+    def run(inputs):
+        responses, links = inputs
+        for response in responses:
+            for _ in scheduler.process_spider_output(response, links, scheduler.spider):
+                pass
+    return setup, run
+
+
+def bench_get_requests_from_backend(scheduler, refills, batch_size):
+    manager = scheduler.frontier.manager
+    converter = scheduler.frontier.request_converter
+
+    def run():
+        for i in range(refills):
+            manager.add_seeds([converter.to_frontier(make_request(i * batch_size + j)) for j in range(batch_size)])
+        elapsed = 0.0
+        for _ in range(refills):
+            start = time.perf_counter()
+            scheduler._get_requests_from_backend()
+            elapsed += time.perf_counter() - start
+            while scheduler.mqs.pop():
+                pass
+        return elapsed
+    return None, run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', help='Write results as json to the given file')
+    parser.add_argument('--requests', type=int, default=10000, help='Number of requests per conversion benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs of each benchmark')
+    args = parser.parse_args()
+
+    n = args.requests
+    scheduler = get_scheduler({'MAX_NEXT_REQUESTS': 256})
+    benchmarks = [
+        ('RequestConverter.to_frontier', bench_request_to_frontier(scheduler, n), n),
+        ('RequestConverter.to_frontier (cached fingerprints)', bench_request_to_frontier_cached(scheduler, n), n),
+        ('RequestConverter.to_frontier_many', bench_request_to_frontier_many(scheduler, n), n),
+        ('RequestConverter.to_frontier (dont_filter)', bench_request_to_frontier_dont_filter(scheduler, n), n),
+        ('RequestConverter.from_frontier', bench_request_from_frontier(scheduler, n), n),
+        ('ResponseConverter.to_frontier', bench_response_to_frontier(scheduler, n), n),
+    ]
+    for links_per_page in (1, 100, 10000):
+        pages = max(1, n // max(links_per_page, 10))
+        benchmarks.append((
+            'process_spider_output ({} links/page)'.format(links_per_page),
+            bench_process_spider_output(scheduler, pages, links_per_page),
+            pages * links_per_page,
+        ))
+    refills = max(1, n // 256)
+    benchmarks.append((
+        '_get_requests_from_backend (256 requests/refill)',
+        bench_get_requests_from_backend(scheduler, refills, 256),
+        refills * 256,
+    ))
+
+    results = {
+        'python': platform.python_version(),
+        'scrapy': scrapy.__version__,
+        'frontera': getattr(frontera, '__version__', None),
+        'scrapy_frontera': scrapy_frontera.__version__,
+        'timestamp': time.time(),
+        'results': [measure(name, func, ops, args.repeat) for name, func, ops in benchmarks],
+    }
+    scheduler.frontier.stop()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
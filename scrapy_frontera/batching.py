@@ -0,0 +1,43 @@
+import time
+
+
+class AdaptiveBatchSize(object):
+    """
+    Sizes each backend refill so local queues hold enough requests to keep the downloader busy during
+    target_seconds plus a backend round-trip, according to the recent dequeue rate. Rate and backend latency
+    are exponentially weighted moving averages.
+    """
+
+    def __init__(self, min_size, max_size, target_seconds, smoothing=0.3):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.smoothing = smoothing
+        self.size = min_size
+        self.dequeue_rate = None
+        self.backend_latency = 0.0
+        self._dequeued = 0
+        self._last_time = time.time()
+
+    def _smooth(self, previous, value):
+        if previous is None:
+            return value
+        return self.smoothing * value + (1 - self.smoothing) * previous
+
+    def request_dequeued(self):
+        self._dequeued += 1
+
+    def backend_called(self, elapsed):
+        self.backend_latency = self._smooth(self.backend_latency, elapsed)
+
+    def next_size(self, queue_depth):
+        now = time.time()
+        elapsed = now - self._last_time
+        if elapsed > 0:
+            self.dequeue_rate = self._smooth(self.dequeue_rate, self._dequeued / elapsed)
+            self._dequeued = 0
+            self._last_time = now
+        if self.dequeue_rate:
+            wanted = self.dequeue_rate * (self.target_seconds + self.backend_latency) - queue_depth
+            self.size = int(min(self.max_size, max(self.min_size, wanted)))
+        return self.size
@@ -0,0 +1,127 @@
+import time
+import logging
+from collections import Counter, deque
+
+from twisted.internet import task
+
+from frontera.contrib.backends.memory import FIFO
+from frontera.core.components import Backend
+
+from scrapy_frontera.recording import read_recording
+
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncMemoryBackend(FIFO):
+    """
+    In-memory FIFO backend which implements the asynchronous backend contract, intended for testing. Every call
+    returns a deferred which fires after ASYNC_MEMORY_BACKEND_DELAY seconds (0 by default), or a coroutine if
+    ASYNC_MEMORY_BACKEND_COROUTINES is set.
+    """
+
+    component_name = 'Async Memory Backend'
+    asynchronous = True
+
+    def __init__(self, manager):
+        super(AsyncMemoryBackend, self).__init__(manager)
+        self.delay = manager.settings.get('ASYNC_MEMORY_BACKEND_DELAY', 0.0)
+        self.coroutines = manager.settings.get('ASYNC_MEMORY_BACKEND_COROUTINES', False)
+
+    def add_seeds(self, seeds):
+        return self._call_later(super(AsyncMemoryBackend, self).add_seeds, seeds)
+
+    def get_next_requests(self, max_next_requests, **kwargs):
+        return self._call_later(super(AsyncMemoryBackend, self).get_next_requests, max_next_requests, **kwargs)
+
+    def page_crawled(self, response):
+        return self._call_later(super(AsyncMemoryBackend, self).page_crawled, response)
+
+    def links_extracted(self, request, links):
+        return self._call_later(super(AsyncMemoryBackend, self).links_extracted, request, links)
+
+    def request_error(self, request, error):
+        return self._call_later(super(AsyncMemoryBackend, self).request_error, request, error)
+
+    def _call_later(self, method, *args, **kwargs):
+        from twisted.internet import reactor
+        dfd = task.deferLater(reactor, self.delay, method, *args, **kwargs)
+        if self.coroutines:
+            return self._await(dfd)
+        return dfd
+
+    async def _await(self, dfd):
+        return await dfd
+
+
+class ReplayBackend(Backend):
+    """
+    Backend which serves a recording made with FRONTERA_SCHEDULER_RECORD_FILE, intended for benchmarking and
+    profiling offline. The recording is given by REPLAY_BACKEND_FILE. get_next_requests() returns the recorded batches
+    in order, whatever the number of requests asked for, and writes are only counted. If REPLAY_BACKEND_DELAYS is set,
+    each call blocks as long as the recorded one did. Managers of a recorded consumer slot only serve batches read
+    from that slot.
+    """
+
+    component_name = 'Replay Backend'
+
+    def __init__(self, manager):
+        self.manager = manager
+        settings = manager.settings
+        self.delays = settings.get('REPLAY_BACKEND_DELAYS', False)
+        calls = list(read_recording(settings.get('REPLAY_BACKEND_FILE')))
+        slot = settings.get(settings.get('FRONTERA_SCHEDULER_CONSUMER_SLOT_SETTING', 'HCF_CONSUMER_SLOT'))
+        self.consumer_slot = slot if slot in {call.consumer_slot for call in calls} else None
+        self._batches = deque()
+        self._durations = {}
+        for call in calls:
+            if call.consumer_slot != self.consumer_slot:
+                continue
+            if call.method == 'get_next_requests' and call.error is None:
+                self._batches.append(call.result)
+            self._durations.setdefault(call.method, deque()).append(call.duration)
+        self.calls_count = Counter()
+
+    @classmethod
+    def from_manager(cls, manager):
+        return cls(manager)
+
+    @property
+    def queue(self):
+        return None
+
+    @property
+    def metadata(self):
+        return None
+
+    @property
+    def states(self):
+        return None
+
+    def frontier_stop(self):
+        LOG.info('Replay finished: %s, %d batches left', dict(self.calls_count), len(self._batches))
+
+    def add_seeds(self, seeds):
+        self._replay('add_seeds')
+
+    def page_crawled(self, response):
+        self._replay('page_crawled')
+
+    def links_extracted(self, request, links):
+        self._replay('links_extracted')
+
+    def request_error(self, request, error):
+        self._replay('request_error')
+
+    def get_next_requests(self, max_next_requests, **kwargs):
+        self._replay('get_next_requests')
+        return self._batches.popleft() if self._batches else []
+
+    def finished(self):
+        return not self._batches
+
+    def _replay(self, method_name):
+        self.calls_count[method_name] += 1
+        durations = self._durations.get(method_name)
+        if self.delays and durations:
+            time.sleep(durations.popleft())
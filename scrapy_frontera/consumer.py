@@ -0,0 +1,58 @@
+import time
+
+
+class ConsumerSlots(object):
+    """
+    Spreads each frontier read across several consumer slots. With the 'round-robin' policy every available slot
+    gets an equal share of the batch, and with the 'backlog' policy shares are weighted by how full the previous
+    batches of each slot were (an exponentially weighted moving average), as an estimate of its backlog. In both
+    cases the order of slots rotates on each read, so remainders are fairly distributed. Slots which return no
+    requests are skipped during backoff seconds.
+    """
+
+    policies = ('round-robin', 'backlog')
+
+    def __init__(self, slots, policy='round-robin', backoff=30.0, smoothing=0.3):
+        if policy not in self.policies:
+            raise ValueError('Unknown consumer slots policy: %r' % policy)
+        self.slots = list(slots)
+        self.policy = policy
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self.fill_ratios = {slot: 1.0 for slot in self.slots}
+        self._backoff_until = {}
+        self._next_index = 0
+
+    def available_slots(self):
+        now = time.time()
+        return [slot for slot in self.slots if self._backoff_until.get(slot, 0) <= now]
+
+    def allocate(self, max_next_requests):
+        """
+        Returns a list of (slot, max_next_requests) pairs to read. Slots with a zero share are not included.
+        """
+        slots = self.available_slots()
+        if not slots:
+            return []
+        start = self._next_index % len(slots)
+        slots = slots[start:] + slots[:start]
+        self._next_index += 1
+        if self.policy == 'backlog':
+            weights = [self.fill_ratios[slot] or self.smoothing for slot in slots]
+        else:
+            weights = [1.0] * len(slots)
+        total_weight = sum(weights)
+        shares = [int(max_next_requests * weight / total_weight) for weight in weights]
+        for i in range(max_next_requests - sum(shares)):
+            shares[i % len(shares)] += 1
+        return [(slot, share) for slot, share in zip(slots, shares) if share]
+
+    def record(self, slot, requested, returned):
+        """
+        Records the result of a read from the given slot.
+        """
+        if requested:
+            ratio = min(returned / float(requested), 1.0)
+            self.fill_ratios[slot] = self.smoothing * ratio + (1 - self.smoothing) * self.fill_ratios[slot]
+        if not returned:
+            self._backoff_until[slot] = time.time() + self.backoff
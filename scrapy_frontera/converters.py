@@ -1,9 +1,19 @@
+import os
 import uuid
+import pickle
+import hashlib
+import inspect
+import functools
+import itertools
 
+import zlib
 import logging
+from collections import namedtuple
+from weakref import WeakKeyDictionary
 
 from scrapy.http.request import Request as ScrapyRequest
 from scrapy.http.response import Response as ScrapyResponse
+from scrapy.utils.httpobj import urlparse_cached
 from scrapy.utils.request import request_fingerprint
 
 from w3lib.util import to_bytes, to_native_str
@@ -12,80 +22,454 @@ from frontera.core.models import Request as FrontierRequest
 from frontera.core.models import Response as FrontierResponse
 from frontera.utils.converters import BaseRequestConverter, BaseResponseConverter
 
-from .utils import get_callback_name
-
 
 _LOG = logging.getLogger(__name__)
 
 
+_MethodPlan = namedtuple("_MethodPlan", ["name", "slot_prefix", "number_of_slots"])
+
+
 class RequestConverter(BaseRequestConverter):
     """Converts between frontera and Scrapy request objects"""
 
+    timings = None
+
     def __init__(self, spider):
         self.spider = spider
+        settings = self.spider.crawler.settings
+        self._build_conversion_plan()
+        self._fingerprints = WeakKeyDictionary()
+        self._fast_dont_filter = settings.getbool("FRONTERA_SCHEDULER_FAST_DONT_FILTER_FINGERPRINT")
+        self._dont_filter_nonce = uuid.uuid4().hex
+        self._dont_filter_counter = itertools.count()
+        self.state_versioning = settings.getbool("FRONTERA_SCHEDULER_STATE_VERSIONING")
+        self.state_store = settings.get("FRONTERA_SCHEDULER_STATE_STORE")
+        if self.state_versioning and not self.state_store:
+            _LOG.warning(
+                "FRONTERA_SCHEDULER_STATE_VERSIONING is enabled, but FRONTERA_SCHEDULER_STATE_STORE is not set. "
+                "Ignoring it."
+            )
+            self.state_versioning = False
+        self._state = None
+        self._state_version = None
+        self._serialized_state = None
+        self._state_hosts = set()
+        self._known_states = {}
+        self._applied_state_version = None
+        self._unknown_state_versions = set()
+        self.stats = self.spider.crawler.stats
+        self._meta_allowlist = frozenset(settings.getlist("FRONTERA_SCHEDULER_META_ALLOWLIST"))
+        self._meta_denylist = frozenset(settings.getlist("FRONTERA_SCHEDULER_META_DENYLIST"))
+        self._meta_max_size = settings.getint("FRONTERA_SCHEDULER_META_MAX_SIZE")
+        self._meta_max_size_action = settings.get("FRONTERA_SCHEDULER_META_MAX_SIZE_ACTION", "warn")
+        self._codec = None
+        if settings.getbool("FRONTERA_SCHEDULER_PAYLOAD_CODEC"):
+            self._codec = PayloadCodec(settings.getint("FRONTERA_SCHEDULER_PAYLOAD_COMPRESS_THRESHOLD", 1024))
+        self._meta_pruning = bool(self._meta_allowlist or self._meta_denylist or self._meta_max_size)
+
+    def _build_conversion_plan(self):
+        """
+        Precomputes everything to_frontier() needs from settings and spider methods, so conversion of each request
+        only needs a few dict lookups.
+        """
+        settings = self.spider.crawler.settings
+        self._state_attributes = tuple(settings.getlist("FRONTERA_SCHEDULER_STATE_ATTRIBUTES", []))
+        self._slot_prefix_map = {}
+        for callback_name, slot_prefix_num_slots in settings.getdict(
+            "FRONTERA_SCHEDULER_CALLBACK_SLOT_PREFIX_MAP"
+        ).items():
+            if not slot_prefix_num_slots:
+                continue
+            slot_prefix, *rest = slot_prefix_num_slots.split("/", 1)
+            self._slot_prefix_map[callback_name] = (slot_prefix, int(rest[0]) if rest else None)
+        self._default_callback_plan = _MethodPlan(None, *self._slot_prefix_map.get("parse", (None, None)))
+        self._method_plans = {}
+        for klass in reversed(type(self.spider).__mro__):
+            for func in vars(klass).values():
+                if inspect.isfunction(func):
+                    self._method_plans[func] = self._make_method_plan(func.__name__)
+
+    def _get_method_plan(self, method):
+        if getattr(method, "__self__", None) is self.spider:
+            plan = self._method_plans.get(method.__func__)
+            if plan is not None:
+                return plan
+        # not a method defined in the spider class. Either fails or it was set dynamically on the instance.
+        _find_method(self.spider, method)
+        plan = self._method_plans[method.__func__] = self._make_method_plan(method.__func__.__name__)
+        return plan
+
+    def _make_method_plan(self, name):
+        return _MethodPlan(to_bytes(name), *self._slot_prefix_map.get(name, (None, None)))
+
+    def refresh_state(self):
+        """
+        Takes a snapshot of the spider state attributes, and computes a new version id if it changed since the previous
+        snapshot. New versions are saved to FRONTERA_SCHEDULER_STATE_STORE. Used when state versioning is enabled.
+        Called once per batch of converted requests, single request conversions use the last snapshot. Spiders which
+        change their state may call it right after, so requests converted alone carry the new version too.
+        """
+        state = self._read_state()
+        try:
+            serialized = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            if self._serialized_state is not False:
+                _LOG.warning("Spider state can't be pickled, it is copied into every request", exc_info=True)
+            # not versioned, as with state versioning disabled
+            self._serialized_state = False
+            self._state, self._state_version = state, None
+            return self._state, self._state_version
+        if serialized != self._serialized_state:
+            state_version = hashlib.sha1(serialized).hexdigest()[:16]
+            self._save_state(state_version, serialized)
+            self._serialized_state = serialized
+            self._state, self._state_version = state, state_version
+            self._state_hosts = set()
+        return self._state, self._state_version
+
+    def _current_state(self):
+        if self._state_version is None:
+            return self.refresh_state()
+        return self._state, self._state_version
+
+    def _state_path(self, state_version):
+        return os.path.join(self.state_store, "%s.state" % state_version)
+
+    def _save_state(self, state_version, serialized):
+        path = self._state_path(state_version)
+        if os.path.exists(path):
+            return
+        os.makedirs(self.state_store, exist_ok=True)
+        # written under a temporary name and renamed, so consumers never read a partial file
+        tmp_path = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+        with open(tmp_path, "wb") as f:
+            f.write(serialized)
+        os.replace(tmp_path, path)
+
+    def _load_state(self, state_version):
+        if not self.state_store:
+            return None
+        try:
+            with open(self._state_path(state_version), "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _embed_state(self, scrapy_request):
+        """
+        Whether the current state must be embedded in the given request: only the first request for each host gets
+        each state version. Backends usually partition requests by host, so every partition receives every version.
+        """
+        host = urlparse_cached(scrapy_request).netloc
+        if host in self._state_hosts:
+            return False
+        self._state_hosts.add(host)
+        return True
+
+    def _read_state(self):
+        return [(attr, getattr(self.spider, attr, None)) for attr in self._state_attributes]
+
+    def to_frontier(self, scrapy_request, embed_state=True):
+        """
+        request: Scrapy > Frontier
+
+        If state versioning is enabled, the request carries the version id of the last state snapshot (see
+        refresh_state()), and the state itself only if embed_state is True and it is the first request for its host
+        with that version, as with to_frontier_many().
+        """
+        if not self.state_versioning:
+            state, state_version = self._read_state(), None
+        else:
+            state, state_version = self._current_state()
+            if state_version is not None and not (embed_state and self._embed_state(scrapy_request)):
+                state = None
+        if self.timings is None:
+            fingerprint = self.fingerprint(scrapy_request)
+        else:
+            with self.timings.timer("fingerprint"):
+                fingerprint = self.fingerprint(scrapy_request)
+        return self._to_frontier(scrapy_request, state, state_version, fingerprint)
+
+    def to_frontier_many(self, scrapy_requests, embed_state=True):
+        """
+        Converts a batch of requests: Scrapy > Frontier
+
+        Spider state is read once for the whole batch, and fingerprints are computed in a single pass. When state
+        versioning is enabled, every request carries the state version id, and the state itself is embedded only in
+        the first request for each host of every state version (never if embed_state is False). Safe to call from a
+        worker thread, as long as the spider doesn't change its state meanwhile.
+        """
+        scrapy_requests = list(scrapy_requests)
+        if self.timings is None:
+            fingerprints = self.fingerprints(scrapy_requests)
+        else:
+            with self.timings.timer("fingerprint"):
+                fingerprints = self.fingerprints(scrapy_requests)
+        if not self.state_versioning:
+            state = self._read_state()
+            return [
+                self._to_frontier(scrapy_request, state, None, fingerprint)
+                for scrapy_request, fingerprint in zip(scrapy_requests, fingerprints)
+            ]
+        state, state_version = self.refresh_state()
+        return [
+            self._to_frontier(
+                scrapy_request,
+                state if state_version is None or embed_state and self._embed_state(scrapy_request) else None,
+                state_version,
+                fingerprint,
+            )
+            for scrapy_request, fingerprint in zip(scrapy_requests, fingerprints)
+        ]
+
+    def snapshot(self):
+        """
+        Returns the conversion context to pass to to_frontier_many_detached(): spider state, its version id and the
+        hosts which already got that version. Must be called from the reactor thread.
+        """
+        if not self.state_versioning:
+            return self._read_state(), None, frozenset()
+        state, state_version = self.refresh_state()
+        return state, state_version, frozenset(self._state_hosts)
+
+    def to_frontier_many_detached(self, scrapy_requests, snapshot):
+        """
+        Same as to_frontier_many(), but safe to run in a worker thread while the reactor thread keeps converting
+        requests: it only reads the given snapshot(), and doesn't modify shared converter data, stats or timings.
+        Fingerprints are not cached, and state embedding and meta pruning counts are returned along with the frontier
+        requests, to be applied by finish_detached() in the reactor thread. The only shared writes left are atomic
+        single dict or counter operations: scrapy's own fingerprint cache, conversion plans of methods set dynamically
+        on the spider, and the dont_filter counter.
+        """
+        state, state_version, state_hosts = snapshot
+        hosts = set()
+        counts = {}
+        frontier_requests = []
+        for scrapy_request in scrapy_requests:
+            fingerprint = self._cached_fingerprint(scrapy_request) or self._compute_fingerprint(scrapy_request)
+            embedded_state = state
+            if state_version is not None:
+                host = urlparse_cached(scrapy_request).netloc
+                if host in state_hosts or host in hosts:
+                    embedded_state = None
+                hosts.add(host)
+            frontier_requests.append(
+                self._to_frontier(scrapy_request, embedded_state, state_version, fingerprint, counts=counts)
+            )
+        return frontier_requests, state_version, hosts, counts
 
-    def to_frontier(self, scrapy_request):
-        """request: Scrapy > Frontier"""
+    def finish_detached(self, result):
+        """
+        Applies the result of a to_frontier_many_detached() call from the reactor thread, and returns its frontier
+        requests.
+        """
+        frontier_requests, state_version, hosts, counts = result
+        if state_version is not None and state_version == self._state_version:
+            self._state_hosts.update(hosts)
+        for key, count in counts.items():
+            self.stats.inc_value(key, count)
+        return frontier_requests
+
+    def _to_frontier(self, scrapy_request, state, state_version, fingerprint, counts=None):
         if isinstance(scrapy_request.cookies, dict):
             cookies = scrapy_request.cookies
         else:
             cookies = dict(sum([list(d.items()) for d in scrapy_request.cookies], []))
         cb = scrapy_request.callback
         if callable(cb):
-            cb = _find_method(self.spider, cb)
+            cb_plan = self._get_method_plan(cb)
+            cb = cb_plan.name
+        else:
+            cb_plan = self._default_callback_plan
         eb = scrapy_request.errback
         if callable(eb):
-            eb = _find_method(self.spider, eb)
+            eb = self._get_method_plan(eb).name
 
-        statevars = self.spider.crawler.settings.getlist("FRONTERA_SCHEDULER_STATE_ATTRIBUTES", [])
         meta = {
             b"scrapy_callback": cb,
             b"scrapy_cb_kwargs": scrapy_request.cb_kwargs,
             b"scrapy_errback": eb,
-            b"scrapy_meta": scrapy_request.meta,
+            b"scrapy_meta": self.prune_meta(scrapy_request.meta, scrapy_request.url, counts),
             b"scrapy_body": scrapy_request.body,
-            b"spider_state": [(attr, getattr(self.spider, attr, None)) for attr in statevars],
             b"origin_is_frontier": True,
+            b"frontier_fingerprint": fingerprint,
         }
-
-        fingerprint_scrapy_request = scrapy_request
-        if fingerprint_scrapy_request.dont_filter:
-            # if dont_filter is True, we need to simulate
-            # not filtering by generating a different fingerprint each time we see same request.
-            # So let's altere randomly the url
-            fake_url = fingerprint_scrapy_request.url + str(uuid.uuid4())
-            fingerprint_scrapy_request = fingerprint_scrapy_request.replace(url=fake_url)
-        meta[b"frontier_fingerprint"] = scrapy_request.meta.get(
-            "frontier_fingerprint", request_fingerprint(fingerprint_scrapy_request)
-        )
-        callback_slot_prefix_map = self.spider.crawler.settings.getdict("FRONTERA_SCHEDULER_CALLBACK_SLOT_PREFIX_MAP")
-        frontier_slot_prefix_num_slots = callback_slot_prefix_map.get(get_callback_name(scrapy_request))
-        if frontier_slot_prefix_num_slots:
-            frontier_slot_prefix, *rest = frontier_slot_prefix_num_slots.split("/", 1)
-            meta[b"frontier_slot_prefix"] = frontier_slot_prefix
-            if rest:
-                meta[b"frontier_number_of_slots"] = int(rest[0])
+        if state_version is not None:
+            meta[b"spider_state_version"] = state_version
+        if state is not None:
+            meta[b"spider_state"] = state
+        if self.timings is not None and counts is None:
+            self.timings.record_size("scrapy_meta", meta[b"scrapy_meta"])
+        if cb_plan.slot_prefix is not None:
+            meta[b"frontier_slot_prefix"] = cb_plan.slot_prefix
+            if cb_plan.number_of_slots is not None:
+                meta[b"frontier_number_of_slots"] = cb_plan.number_of_slots
+        headers = dict(scrapy_request.headers.items())
+        if self._codec is not None:
+            meta[b"scrapy_payload"] = self._codec.encode(
+                {field: meta.pop(field) for field in PayloadCodec.fields if field in meta}, headers, cookies
+            )
+            headers, cookies = {}, {}
         return FrontierRequest(
             url=scrapy_request.url,
             method=scrapy_request.method,
-            headers=dict(scrapy_request.headers.items()),
+            headers=headers,
             cookies=cookies,
             meta=meta,
         )
 
+    def prune_meta(self, scrapy_meta, url, counts=None):
+        """
+        Returns the request meta to send to the frontier, according to the allow and deny lists, and checks it
+        against the size budget. The original meta dict is never modified. If counts is given, pruning stats are
+        added to that dict instead of the stats collector.
+        """
+        if not self._meta_pruning:
+            return scrapy_meta
+        pruned_keys = [
+            key
+            for key in scrapy_meta
+            if key in self._meta_denylist or (self._meta_allowlist and key not in self._meta_allowlist)
+        ]
+        inc_value = self.stats.inc_value if counts is None else functools.partial(_inc_count, counts)
+        if pruned_keys:
+            pruned_meta = {key: value for key, value in scrapy_meta.items() if key not in pruned_keys}
+            inc_value("scrapyfrontera/meta_pruned_keys_count", len(pruned_keys))
+            inc_value(
+                "scrapyfrontera/meta_pruned_bytes",
+                sum(_pickled_size({key: scrapy_meta[key]}) for key in pruned_keys),
+            )
+        else:
+            pruned_meta = scrapy_meta
+        if self._meta_max_size:
+            size = _pickled_size(pruned_meta)
+            if size > self._meta_max_size:
+                inc_value("scrapyfrontera/meta_max_size_exceeded_count")
+                message = "Request <%s> meta size (%d bytes) exceeds FRONTERA_SCHEDULER_META_MAX_SIZE (%d bytes)" % (
+                    url,
+                    size,
+                    self._meta_max_size,
+                )
+                if self._meta_max_size_action == "error":
+                    raise ValueError(message)
+                _LOG.warning(message)
+        return pruned_meta
+
+    def fingerprints(self, scrapy_requests):
+        """Returns the frontier fingerprints of the given scrapy requests"""
+        fingerprint = self.fingerprint
+        return [fingerprint(scrapy_request) for scrapy_request in scrapy_requests]
+
+    def fingerprint(self, scrapy_request):
+        """Returns the frontier fingerprint of the given scrapy request"""
+        fingerprint = self._cached_fingerprint(scrapy_request)
+        if fingerprint is None:
+            fingerprint = self._fingerprints[scrapy_request] = self._compute_fingerprint(scrapy_request)
+        return fingerprint
+
+    def _cached_fingerprint(self, scrapy_request):
+        fingerprint = scrapy_request.meta.get("frontier_fingerprint")
+        if fingerprint is not None:
+            return fingerprint
+        origin = scrapy_request.meta.get("frontier_origin")
+        if origin is not None and origin[0] == scrapy_request.url and origin[1] is not None:
+            return origin[1]
+        # same request object is usually converted several times (links_extracted, page_crawled, request_error)
+        return self._fingerprints.get(scrapy_request)
+
+    def _compute_fingerprint(self, scrapy_request):
+        if not scrapy_request.dont_filter:
+            fingerprint = request_fingerprint(scrapy_request)
+        elif self._fast_dont_filter:
+            # derive a unique fingerprint from the regular one, a per process nonce and a counter
+            unique_key = "%s%s%d" % (request_fingerprint(scrapy_request), self._dont_filter_nonce,
+                                     next(self._dont_filter_counter))
+            fingerprint = hashlib.sha1(unique_key.encode("ascii")).hexdigest()
+        else:
+            # if dont_filter is True, we need to simulate
+            # not filtering by generating a different fingerprint each time we see same request.
+            # So let's altere randomly the url
+            fake_url = scrapy_request.url + str(uuid.uuid4())
+            fingerprint = request_fingerprint(scrapy_request.replace(url=fake_url))
+        return fingerprint
+
     def from_frontier(self, frontier_request):
         """request: Frontier > Scrapy"""
-        cb = frontier_request.meta.get(b"scrapy_callback", None)
+        frontier_meta = frontier_request.meta
+        headers = frontier_request.headers
+        cookies = frontier_request.cookies
+        if b"scrapy_payload" in frontier_meta:
+            frontier_meta = dict(frontier_meta)
+            payload = PayloadCodec.decode(frontier_meta.pop(b"scrapy_payload"))
+            headers = payload.pop(b"headers")
+            cookies = payload.pop(b"cookies")
+            frontier_meta.update(payload)
+        cb = frontier_meta.get(b"scrapy_callback", None)
         if cb and self.spider:
             cb = _get_method(self.spider, cb)
-        eb = frontier_request.meta.get(b"scrapy_errback", None)
+        eb = frontier_meta.get(b"scrapy_errback", None)
         if eb and self.spider:
             eb = _get_method(self.spider, eb)
-        body = frontier_request.meta.get(b"scrapy_body", None)
-        cb_kwargs = frontier_request.meta[b"scrapy_cb_kwargs"]
-        meta = frontier_request.meta[b"scrapy_meta"]
+        body = frontier_meta.get(b"scrapy_body", None)
+        cb_kwargs = frontier_meta[b"scrapy_cb_kwargs"]
+        meta = frontier_meta[b"scrapy_meta"]
         meta.pop("cf_store", None)
-        for attr, val in frontier_request.meta.get(b"spider_state", []):
+        if b"frontier_consumer_slot" in frontier_meta:
+            meta["frontier_consumer_slot"] = frontier_meta[b"frontier_consumer_slot"]
+        state_version = frontier_meta.get(b"spider_state_version")
+        if state_version is None:
+            self._apply_spider_state(frontier_meta.get(b"spider_state", []), frontier_request.url)
+        elif state_version != self._applied_state_version:
+            self._apply_versioned_spider_state(frontier_meta.get(b"spider_state"), state_version, frontier_request.url)
+
+        scrapy_request = ScrapyRequest(
+            url=frontier_request.url,
+            callback=cb,
+            errback=eb,
+            body=body,
+            method=to_native_str(frontier_request.method),
+            headers=headers,
+            cookies=cookies,
+            meta=meta,
+            cb_kwargs=cb_kwargs,
+            dont_filter=True,
+        )
+        # mark the request with the url it was read with and its frontier fingerprint, so it is recognized and reported
+        # back with that fingerprint, even after going through disk queues
+        scrapy_request.meta["frontier_origin"] = (scrapy_request.url, frontier_meta.get(b"frontier_fingerprint"))
+        return scrapy_request
+
+    def is_from_frontier(self, request):
+        """
+        True if the given request was read from the frontier. Requests built from it with another url (like redirects,
+        or new requests which copy its meta) are not.
+        """
+        origin = request.meta.get("frontier_origin")
+        return origin is not None and origin[0] == request.url
+
+    def _apply_versioned_spider_state(self, state, state_version, url):
+        if state is None:
+            state = self._known_states.get(state_version)
+            if state is None:
+                state = self._load_state(state_version)
+                if state is not None:
+                    self._known_states[state_version] = state
+        else:
+            self._known_states[state_version] = state
+        if state is None:
+            if state_version not in self._unknown_state_versions:
+                self._unknown_state_versions.add(state_version)
+                _LOG.warning(
+                    "Request <%s> refers to unknown spider state version %s, state not updated",
+                    url,
+                    state_version,
+                )
+            return
+        self._apply_spider_state(state, url)
+        self._applied_state_version = state_version
+
+    def _apply_spider_state(self, state, url):
+        for attr, val in state:
             prev_value = getattr(self.spider, attr, None)
             if prev_value is not None and prev_value != val:
                 _LOG.error(
@@ -94,24 +478,53 @@ class RequestConverter(BaseRequestConverter):
                     attr,
                     prev_value,
                     val,
-                    frontier_request.url,
+                    url,
                 )
             elif prev_value != val:
                 setattr(self.spider, attr, val)
-                _LOG.info("State for attribute '%s' set to %s by request <%s>", attr, val, frontier_request.url)
+                _LOG.info("State for attribute '%s' set to %s by request <%s>", attr, val, url)
 
-        return ScrapyRequest(
-            url=frontier_request.url,
-            callback=cb,
-            errback=eb,
-            body=body,
-            method=to_native_str(frontier_request.method),
-            headers=frontier_request.headers,
-            cookies=frontier_request.cookies,
-            meta=meta,
-            cb_kwargs=cb_kwargs,
-            dont_filter=True,
-        )
+
+class PayloadCodec(object):
+    """
+    Packs the scrapy specific fields of a frontier request (callbacks, meta, body, state, headers and cookies) into
+    a single binary blob, which is decoded only when the request is converted back to scrapy. Bodies larger than
+    compress_threshold bytes are zlib compressed (0 disables compression).
+    """
+
+    fields = (
+        b"scrapy_callback",
+        b"scrapy_cb_kwargs",
+        b"scrapy_errback",
+        b"scrapy_meta",
+        b"scrapy_body",
+        b"spider_state",
+    )
+    version = b"\x01"
+    # fixed protocol, so producers and consumers on different python versions understand each other
+    pickle_protocol = 4
+
+    def __init__(self, compress_threshold=1024):
+        self.compress_threshold = compress_threshold
+
+    def encode(self, fields, headers, cookies):
+        body = fields.get(b"scrapy_body") or b""
+        compressed = bool(self.compress_threshold and len(body) >= self.compress_threshold)
+        if compressed:
+            fields[b"scrapy_body"] = zlib.compress(body)
+        fields[b"headers"] = headers
+        fields[b"cookies"] = cookies
+        fields[b"body_compressed"] = compressed
+        return self.version + pickle.dumps(fields, protocol=self.pickle_protocol)
+
+    @classmethod
+    def decode(cls, blob):
+        if blob[:1] != cls.version:
+            raise ValueError("Unknown frontier payload version: %r" % blob[:1])
+        fields = pickle.loads(blob[1:])
+        if fields.pop(b"body_compressed"):
+            fields[b"scrapy_body"] = zlib.decompress(fields[b"scrapy_body"])
+        return fields
 
 
 class ResponseConverter(BaseResponseConverter):
@@ -120,18 +533,27 @@ class ResponseConverter(BaseResponseConverter):
     def __init__(self, spider, request_converter):
         self.spider = spider
         self._request_converter = request_converter
+        self._skip_body = spider.crawler.settings.getbool("FRONTERA_SCHEDULER_PAGE_CRAWLED_SKIP_BODY")
 
     def to_frontier(self, scrapy_response):
         """response: Scrapy > Frontier"""
-        frontier_request = scrapy_response.meta.get(
-            "frontier_request", self._request_converter.to_frontier(scrapy_response.request)
-        )
-        frontier_request.meta[b"scrapy_meta"] = scrapy_response.meta
+        frontier_request = scrapy_response.meta.get("frontier_request")
+        if frontier_request is None:
+            frontier_request = self._request_converter.to_frontier(scrapy_response.request)
+        # with the payload codec, meta is already packed into the payload, which takes precedence when decoding
+        if b"scrapy_payload" not in frontier_request.meta:
+            frontier_request.meta[b"scrapy_meta"] = self._request_converter.prune_meta(
+                scrapy_response.meta, scrapy_response.url
+            )
+        if self._skip_body:
+            headers, body = {}, b""
+        else:
+            headers, body = dict(scrapy_response.headers.items()), scrapy_response.body
         return FrontierResponse(
             url=scrapy_response.url,
             status_code=scrapy_response.status,
-            headers=dict(scrapy_response.headers.items()),
-            body=scrapy_response.body,
+            headers=headers,
+            body=body,
             request=frontier_request,
         )
 
@@ -146,6 +568,17 @@ class ResponseConverter(BaseResponseConverter):
         )
 
 
+def _inc_count(counts, key, count=1):
+    counts[key] = counts.get(key, 0) + count
+
+
+def _pickled_size(obj):
+    try:
+        return len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return 0
+
+
 def _find_method(obj, func):
     if obj and hasattr(func, "__self__") and func.__self__ is obj:
         return to_bytes(func.__func__.__name__)
@@ -1,3 +1,9 @@
+import asyncio
+import inspect
+
+from twisted.internet import defer, threads
+from twisted.python.threadpool import ThreadPool
+
 from frontera.core.manager import FrontierManager as FronteraFrontierManager
 from frontera.settings import Settings
 
@@ -5,6 +11,15 @@ from scrapy_frontera.settings import DEFAULT_SETTINGS
 
 
 class FrontierManager(FronteraFrontierManager):
+    """
+    Besides regular frontera backends, supports asynchronous backends: backends with an ``asynchronous`` attribute set
+    to True, whose methods may return deferreds or coroutines. For those, get_next_requests() returns a deferred, and
+    the result of the backend in other calls is available through pop_backend_result(). Use
+    :class:`AsyncFrontierManager` to get a uniform deferred based interface for both kinds of backends.
+    """
+
+    _backend_result = None
+
     @classmethod
     def from_settings(cls, settings=None):
         """
@@ -26,3 +41,110 @@ class FrontierManager(FronteraFrontierManager):
             settings=manager_settings,
             canonicalsolver=manager_settings.CANONICAL_SOLVER,
         )
+
+    @property
+    def asynchronous(self):
+        return bool(getattr(self.backend, 'asynchronous', False))
+
+    def get_next_requests(self, max_next_requests=0, **kwargs):
+        if not self.asynchronous:
+            return super(FrontierManager, self).get_next_requests(max_next_requests=max_next_requests, **kwargs)
+        self._check_startstop()
+        if self.max_requests and self.n_requests >= self.max_requests:
+            self._logger.info('MAX PAGES REACHED! (%s/%s)', self.n_requests, self.max_requests)
+            self._finished = True
+            return defer.succeed([])
+        max_next_requests = max_next_requests or self.max_next_requests
+        if self.max_requests:
+            max_next_requests = min(max_next_requests or self.max_requests, self.max_requests - self.n_requests)
+        dfd = maybe_deferred(self.backend.get_next_requests(max_next_requests, **kwargs))
+        dfd.addCallback(self._next_requests_returned)
+        return dfd
+
+    def _next_requests_returned(self, next_requests):
+        self._n_requests += len(next_requests)
+        if next_requests:
+            self._iteration += 1
+        return next_requests
+
+    def _process_component(self, component, method_name, component_category, obj, return_classes, **kwargs):
+        if component is self.backend and self.asynchronous:
+            self._backend_result = getattr(component, method_name)(*([obj] if obj else []), **kwargs)
+            return None
+        return super(FrontierManager, self)._process_component(
+            component, method_name, component_category, obj, return_classes, **kwargs
+        )
+
+    def return_requests(self, requests):
+        """
+        Hands back to the backend requests which were read but not crawled. Backends may implement
+        return_requests(requests), otherwise requests are added again as seeds.
+        """
+        if not hasattr(self.backend, 'return_requests'):
+            return self.add_seeds(requests)
+        self._check_startstop()
+        result = self.backend.return_requests(requests)
+        if self.asynchronous:
+            self._backend_result = result
+            return None
+        return result
+
+    def pop_backend_result(self):
+        """
+        Returns the result of the last asynchronous backend call (None if it was filtered by a middleware).
+        """
+        result, self._backend_result = self._backend_result, None
+        return result
+
+
+class AsyncFrontierManager(object):
+    """
+    Deferred based interface to a :class:`FrontierManager`. Calls to asynchronous backends are done in the reactor
+    thread, and wait for the deferreds or coroutines they return. Calls to regular backends are done in a thread pool
+    of at most max_threads threads, so the backend must be thread-safe unless max_threads is 1.
+    """
+
+    write_methods = ('add_seeds', 'page_crawled', 'links_extracted', 'request_error')
+
+    def __init__(self, manager, max_threads=4):
+        self.manager = manager
+        self.threadpool = None
+        if not manager.asynchronous:
+            self.threadpool = ThreadPool(minthreads=0, maxthreads=max_threads, name='frontier')
+            self.threadpool.start()
+
+    def call(self, method_name, *args, **kwargs):
+        """
+        Calls the given frontier manager method, and returns a deferred which fires with its result.
+        """
+        if self.threadpool is not None:
+            from twisted.internet import reactor
+            method = getattr(self.manager, method_name)
+            return threads.deferToThreadPool(reactor, self.threadpool, method, *args, **kwargs)
+        if method_name == 'get_next_requests':
+            return self.manager.get_next_requests(*args, **kwargs)
+        try:
+            getattr(self.manager, method_name)(*args, **kwargs)
+        except Exception:
+            return defer.fail()
+        return maybe_deferred(self.manager.pop_backend_result())
+
+    def stop(self):
+        if self.threadpool is not None:
+            self.threadpool.stop()
+
+
+def maybe_deferred(result):
+    """
+    Returns a deferred for the result of an asynchronous backend call: deferreds are returned as they are, coroutines
+    are scheduled (as asyncio tasks if the asyncio reactor is installed), and other values are wrapped in an already
+    fired deferred.
+    """
+    if isinstance(result, defer.Deferred):
+        return result
+    if inspect.isawaitable(result):
+        from twisted.internet import reactor
+        if type(reactor).__name__ == 'AsyncioSelectorReactor':
+            return defer.Deferred.fromFuture(asyncio.ensure_future(result))
+        return defer.ensureDeferred(result)
+    return defer.succeed(result)
@@ -1,6 +1,26 @@
+import os
+import time
+import pickle
+import logging
+from contextlib import nullcontext
+from itertools import count, islice
+
+from twisted.internet import defer, reactor, task, threads
+from scrapy.utils.log import failure_to_exc_info
+
+from frontera.contrib.scrapy.settings_adapter import ScrapySettingsAdapter
+
+from .consumer import ConsumerSlots
 from .converters import RequestConverter, ResponseConverter
+from .recording import FrontierRecorder
+from .spool import FrontierSpool
+from .timings import StageTimings
+from .utils import BloomFilter
+
+from scrapy_frontera.core.manager import AsyncFrontierManager, FrontierManager
+
 
-from scrapy_frontera.core.manager import FrontierManager
+LOG = logging.getLogger(__name__)
 
 
 class ScrapyFrontierManager(object):
@@ -12,33 +32,802 @@ class ScrapyFrontierManager(object):
         self.spider = spider
         self.request_converter = RequestConverter(self.spider)
         self.response_converter = ResponseConverter(self.spider, self.request_converter)
+        self.stats = spider.crawler.stats
+
+        settings = spider.crawler.settings
+        self.links_buffer_size = settings.getint('FRONTERA_SCHEDULER_LINKS_BUFFER_SIZE')
+        self.links_buffer_max_bytes = settings.getint('FRONTERA_SCHEDULER_LINKS_BUFFER_MAX_BYTES')
+        self.links_buffer_timeout = settings.getfloat('FRONTERA_SCHEDULER_LINKS_BUFFER_TIMEOUT')
+        if self.links_buffer_timeout:
+            self._links_buffer_task = task.LoopingCall(self.flush_links)
+            self._links_buffer_task.start(self.links_buffer_timeout, now=False)
+        self.errors_buffer_size = settings.getint('FRONTERA_SCHEDULER_ERRORS_BUFFER_SIZE')
+        errors_buffer_timeout = settings.getfloat('FRONTERA_SCHEDULER_ERRORS_BUFFER_TIMEOUT')
+        if errors_buffer_timeout:
+            self._errors_buffer_task = task.LoopingCall(self.flush_errors)
+            self._errors_buffer_task.start(errors_buffer_timeout, now=False)
+        self.errors_buffering = bool(self.errors_buffer_size or errors_buffer_timeout)
+        self.reported_errors = set(settings.getlist('FRONTERA_SCHEDULER_REPORTED_ERRORS'))
+        self.seeds_chunk_size = settings.getint('FRONTERA_SCHEDULER_SEEDS_CHUNK_SIZE')
+        self.seeds_in_background = settings.getbool('FRONTERA_SCHEDULER_SEEDS_IN_BACKGROUND')
+        self.convert_in_thread_threshold = settings.getint('FRONTERA_SCHEDULER_CONVERT_IN_THREAD_THRESHOLD')
+        links_dedup_capacity = settings.getint('FRONTERA_SCHEDULER_LINKS_DEDUP_CAPACITY')
+        if links_dedup_capacity:
+            self._links_dedup = BloomFilter(
+                links_dedup_capacity, settings.getfloat('FRONTERA_SCHEDULER_LINKS_DEDUP_ERROR_RATE', 0.001)
+            )
+        if settings.getbool('FRONTERA_SCHEDULER_STATS_TIMING'):
+            self.timings = self.request_converter.timings = StageTimings(self.stats)
+            timings_log_interval = settings.getfloat('FRONTERA_SCHEDULER_STATS_LOG_INTERVAL')
+            if timings_log_interval:
+                self._timings_log_task = task.LoopingCall(self.timings.log)
+                self._timings_log_task.start(timings_log_interval, now=False)
+        spool_dir = settings.get('FRONTERA_SCHEDULER_SPOOL_DIR')
+        if spool_dir:
+            self.spool = FrontierSpool(
+                spool_dir, settings.getint('FRONTERA_SCHEDULER_SPOOL_SEGMENT_SIZE', 1000), weigh=_spool_record_weight
+            )
+            self.spool_drain_on_close = settings.getbool('FRONTERA_SCHEDULER_SPOOL_DRAIN_ON_CLOSE', True)
+            self.spool_drain_interval = settings.getfloat('FRONTERA_SCHEDULER_SPOOL_DRAIN_INTERVAL', 1.0)
+            self._spool_task = task.LoopingCall(self._drain_spool)
+            self._spool_task.start(self.spool_drain_interval, now=False)
+        # with prefetching or spooling, reads or writes are sent from the backend worker thread, so all the other calls
+        # are sent from it too, and the reactor thread never waits on the backend
+        self.asynchronous = (
+            settings.getbool('FRONTERA_SCHEDULER_ASYNC_BACKEND')
+            or settings.getbool('FRONTERA_SCHEDULER_PREFETCH')
+            or self.spool is not None
+            or (self.manager is not None and self.manager.asynchronous)
+        )
+        self.async_backend_threads = settings.getint('FRONTERA_SCHEDULER_ASYNC_BACKEND_THREADS', 1)
+        consumer_slots = settings.getlist('FRONTERA_SCHEDULER_CONSUMER_SLOTS')
+        if consumer_slots:
+            self.consumer_slots = ConsumerSlots(
+                consumer_slots,
+                policy=settings.get('FRONTERA_SCHEDULER_CONSUMER_SLOTS_POLICY', 'round-robin'),
+                backoff=settings.getfloat('FRONTERA_SCHEDULER_CONSUMER_SLOTS_BACKOFF', 30.0),
+            )
+            self.consumer_slot_setting = settings.get('FRONTERA_SCHEDULER_CONSUMER_SLOT_SETTING', 'HCF_CONSUMER_SLOT')
+            if self.manager is not None:
+                self.slot_managers = self._build_slot_managers()
+        record_file = settings.get('FRONTERA_SCHEDULER_RECORD_FILE')
+        if record_file:
+            self.recorder = FrontierRecorder(record_file)
+        self.return_requests_file = settings.get('FRONTERA_SCHEDULER_RETURN_REQUESTS_FILE')
+        if self.return_requests_file and os.path.exists(self.return_requests_file):
+            self._add_saved_requests()
+
+    def __init__(self, settings, background_start=False):
+        """
+        If background_start is True, the frontier manager is not built until start_in_background() is called.
+        """
+        self.settings = settings
+        self.manager = None if background_start else FrontierManager.from_settings(settings)
+        self._starting_waiters = None
+        self._pending_calls = []
+        self.consumer_slots = None
+        self.slot_managers = {}
+        self.asynchronous = False
+        self._async_managers = {}
+        self._async_calls = {}
+        self._links_buffer_request = None
+        self._links_buffer = []
+        self._links_buffer_bytes = 0
+        self._links_buffer_task = None
+        self._errors_buffer = {}
+        self._errors_buffer_task = None
+        self._seeding_task = None
+        self._links_dedup = None
+        self._conversions = {}
+        self._conversions_counter = count()
+        self.timings = None
+        self._timings_log_task = None
+        self.spool = None
+        self._spool_task = None
+        self._spool_draining = None
+        self.return_requests_file = None
+        self.recorder = None
+
+    @property
+    def links_buffering(self):
+        return bool(self.links_buffer_size or self.links_buffer_max_bytes or self.links_buffer_timeout)
+
+    @property
+    def pending_writes(self):
+        """
+        Number of requests written to the frontier and not acknowledged by the backend yet, wherever they wait: links
+        being converted or buffered, request errors buffered, and links, seeds, errors and crawled pages spooled,
+        waiting for the frontier to start or being sent. Each link, seed, request error or crawled page counts once,
+        whatever the number of calls they are sent in.
+        """
+        pending = len(self._links_buffer) + sum(len(links) for _, links in self._conversions.values())
+        pending += len(self._errors_buffer)
+        pending += sum(_write_weight(method_name, args) for method_name, args, _ in self._pending_calls)
+        pending += sum(self._async_calls.values())
+        if self.spool is not None:
+            pending += self.spool.weight
+        return pending
+
+    def timer(self, stage):
+        """
+        Context manager which records the time spent in the given stage, if timings are enabled.
+        """
+        if self.timings is None:
+            return nullcontext()
+        return self.timings.timer(stage)
+
+    def _call_backend(self, method_name, *args, consumer_slot=None, **kwargs):
+        """
+        Calls the given frontier manager method. If consumer_slot is given, the manager of that consumer slot is used.
+        If backend calls are asynchronous, a deferred is returned, see _call_backend_async().
+        """
+        if self.manager is None:
+            # frontier is still starting in background
+            self._pending_calls.append((method_name, args, dict(kwargs, consumer_slot=consumer_slot)))
+            return None
+        manager = self.manager if consumer_slot is None else self.slot_managers.get(consumer_slot, self.manager)
+        if self.recorder is not None:
+            return self._call_backend_recording(manager, method_name, args, kwargs, consumer_slot)
+        if self.asynchronous:
+            return self._call_backend_async(manager, method_name, *args, **kwargs)
+        with self.timer('backend/' + method_name):
+            return getattr(manager, method_name)(*args, **kwargs)
+
+    def _call_backend_recording(self, manager, method_name, args, kwargs, consumer_slot):
+        """
+        Calls the backend as _call_backend() does, and records the call in FRONTERA_SCHEDULER_RECORD_FILE.
+        """
+        token = self.recorder.start(method_name, args, consumer_slot)
+        if self.asynchronous:
+            dfd = self._call_backend_async(manager, method_name, *args, **kwargs)
+            dfd.addCallbacks(self._recorded_call_finished, self._recorded_call_failed,
+                             callbackArgs=(token,), errbackArgs=(token,))
+            return dfd
+        try:
+            with self.timer('backend/' + method_name):
+                result = getattr(manager, method_name)(*args, **kwargs)
+        except Exception as e:
+            self.recorder.finish(token, error=repr(e))
+            raise
+        return self._recorded_call_finished(result, token)
+
+    def _recorded_call_finished(self, result, token):
+        if self.recorder is not None:
+            self.recorder.finish(token, result=result)
+        return result
+
+    def _recorded_call_failed(self, failure, token):
+        if self.recorder is not None:
+            self.recorder.finish(token, error=repr(failure.value))
+        return failure
+
+    def _call_backend_async(self, manager, method_name, *args, **kwargs):
+        """
+        Calls the backend without blocking the reactor, see AsyncFrontierManager. Returns a deferred. Regular backends
+        are called from a single worker thread, unless FRONTERA_SCHEDULER_ASYNC_BACKEND_THREADS is bigger than 1.
+        """
+        async_manager = self._async_managers.get(manager)
+        if async_manager is None:
+            async_manager = AsyncFrontierManager(manager, self.async_backend_threads)
+            self._async_managers[manager] = async_manager
+        dfd = async_manager.call(method_name, *args, **kwargs)
+        self._async_calls[dfd] = _write_weight(method_name, args)
+        dfd.addBoth(self._async_call_finished, dfd, method_name, time.time())
+        return dfd
+
+    def _async_call_finished(self, result, dfd, method_name, start):
+        self._async_calls.pop(dfd, None)
+        if self.timings is not None:
+            self.timings.record('backend/' + method_name, time.time() - start)
+        return result
+
+    def _call_backend_write(self, method_name, *args, **kwargs):
+        result = self._call_backend(method_name, *args, **kwargs)
+        if isinstance(result, defer.Deferred):
+            result.addErrback(self._async_write_failed, method_name)
+
+    def _async_write_failed(self, failure, method_name):
+        LOG.error('Error in frontier %s call', method_name, exc_info=failure_to_exc_info(failure))
 
-    def __init__(self, settings):
-        self.manager = FrontierManager.from_settings(settings)
+    @property
+    def calling(self):
+        """
+        True if there are asynchronous backend calls in progress.
+        """
+        return bool(self._async_calls)
+
+    def _write(self, method_name, *args, consumer_slot=None):
+        """
+        Sends a write to the backend, or appends it to the spool if enabled.
+        """
+        if self.spool is not None:
+            record = (method_name, args) if consumer_slot is None else (method_name, args, consumer_slot)
+            try:
+                self.spool.append(record)
+            except Exception:
+                LOG.warning('Could not spool frontier %s call, sending it directly', method_name, exc_info=True)
+            else:
+                self.stats.inc_value('scrapyfrontera/spool_written_count')
+                return
+        self._call_backend_write(method_name, *args, consumer_slot=consumer_slot)
+
+    def _build_slot_managers(self):
+        """
+        Builds a frontier manager for each consumer slot, with the same settings as the main one except the setting
+        which selects the slot.
+        """
+        slot_managers = {}
+        for slot in self.consumer_slots.slots:
+            slot_settings = ScrapySettingsAdapter(self.spider.crawler.settings)
+            slot_settings.set_from_dict(self.settings.attributes)
+            slot_settings.set(self.consumer_slot_setting, slot)
+            slot_managers[slot] = FrontierManager.from_settings(slot_settings)
+        return slot_managers
+
+    @property
+    def finished(self):
+        if self.consumer_slots is not None:
+            return all(manager.finished for manager in self.slot_managers.values())
+        return self.manager.finished
 
     def start(self):
         self.manager.start()
+        for manager in self.slot_managers.values():
+            if not manager.auto_start:
+                manager.start()
+
+    def start_in_background(self):
+        """
+        Builds and starts the frontier manager in a worker thread. Frontier writes made meanwhile are queued, and sent
+        once the manager is ready. Returns a deferred which fires when the manager is ready.
+        """
+        self._starting_waiters = []
+        dfd = threads.deferToThread(self._build_managers)
+        dfd.addCallback(self._managers_built, time.time())
+        dfd.addErrback(self._manager_failed)
+        return dfd
+
+    def _build_managers(self):
+        manager = FrontierManager.from_settings(self.settings)
+        slot_managers = self._build_slot_managers() if self.consumer_slots is not None else {}
+        for _manager in [manager] + list(slot_managers.values()):
+            if not _manager.auto_start:
+                _manager.start()
+        return manager, slot_managers
+
+    def _managers_built(self, managers, start):
+        self.manager, self.slot_managers = managers
+        self.asynchronous = self.asynchronous or self.manager.asynchronous
+        self.stats.set_value('scrapyfrontera/init_time', time.time() - start)
+        pending_calls, self._pending_calls = self._pending_calls, []
+        for method_name, args, kwargs in pending_calls:
+            self._call_backend_write(method_name, *args, **kwargs)
+        self.stats.set_value('scrapyfrontera/init_queued_calls_count', len(pending_calls))
+        self._notify_started()
+        return managers
+
+    def _manager_failed(self, failure):
+        LOG.error('Error while starting frontier', exc_info=failure_to_exc_info(failure))
+        self._notify_started()
+        return failure
+
+    def _notify_started(self):
+        waiters, self._starting_waiters = self._starting_waiters, None
+        for waiter in waiters:
+            waiter.callback(None)
+
+    @property
+    def ready(self):
+        return self.manager is not None
+
+    @property
+    def starting(self):
+        return self._starting_waiters is not None
+
+    def when_started(self):
+        """
+        Returns a deferred which fires when the background start finishes, successfully or not.
+        """
+        if self._starting_waiters is None:
+            return defer.succeed(None)
+        waiter = defer.Deferred()
+        self._starting_waiters.append(waiter)
+        return waiter
+
+    @property
+    def seeding(self):
+        return self._seeding_task is not None
+
+    @property
+    def converting(self):
+        return bool(self._conversions)
 
     def stop(self):
+        if self._seeding_task is not None:
+            self._seeding_task.stop()
+        if self._links_buffer_task is not None and self._links_buffer_task.running:
+            self._links_buffer_task.stop()
+        for key in list(self._conversions):
+            frontera_request, links = self._conversions.pop(key)
+            self._send_links(frontera_request, self.request_converter.to_frontier_many(links))
+        self.flush_links()
+        if self._errors_buffer_task is not None and self._errors_buffer_task.running:
+            self._errors_buffer_task.stop()
+        self.flush_errors()
+        if self._timings_log_task is not None and self._timings_log_task.running:
+            self._timings_log_task.stop()
+        if self.timings is not None:
+            self.timings.update_percentiles()
+        if self.spool is not None:
+            dfd = self._close_spool()
+            if dfd is not None:
+                # sends spooled writes before stopping the backend
+                return dfd.addCallback(lambda _: self._stop_backend())
+        return self._stop_backend()
+
+    def _stop_backend(self):
+        if self.manager is None:
+            if self._pending_calls:
+                LOG.warning('Frontier did not start, %d frontier calls were not sent', len(self._pending_calls))
+            self._close_recorder()
+            return
+        if self._async_calls:
+            # returns a deferred, so the scheduler waits for in progress backend calls before stopping it
+            dfd = defer.DeferredList(list(self._async_calls))
+            dfd.addCallback(lambda _: self._stop_managers())
+            return dfd
+        self._stop_managers()
+
+    def _stop_managers(self):
+        self._close_recorder()
+        # waits for worker threads to finish, before stopping the backends
+        for async_manager in self._async_managers.values():
+            async_manager.stop()
         self.manager.stop()
+        for manager in self.slot_managers.values():
+            manager.stop()
+
+    def _close_recorder(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.stats.set_value('scrapyfrontera/recorded_calls_count', self.recorder.count)
+            self.recorder = None
 
     def add_seeds(self, seeds):
-        frontier_seeds = [self.request_converter.to_frontier(seed) for seed in seeds]
-        self.manager.add_seeds(seeds=frontier_seeds)
+        """
+        If FRONTERA_SCHEDULER_SEEDS_CHUNK_SIZE is set, seeds are consumed and sent to the backend in chunks of that
+        size. Additionally, if FRONTERA_SCHEDULER_SEEDS_IN_BACKGROUND is set, chunks are sent cooperatively with the
+        reactor, so crawling can start before seeding ends.
+        """
+        if not self.seeds_chunk_size:
+            with self.timer('convert/seeds'):
+                frontier_seeds = self.request_converter.to_frontier_many(seeds)
+            self._write('add_seeds', frontier_seeds)
+            self.stats.inc_value('scrapyfrontera/seeds_count', len(frontier_seeds))
+        elif self.seeds_in_background:
+            self._seeding_task = task.cooperate(self._add_seeds_chunks(seeds))
+            dfd = self._seeding_task.whenDone()
+            dfd.addErrback(self._seeding_failed)
+            dfd.addBoth(self._seeding_finished)
+        else:
+            for _ in self._add_seeds_chunks(seeds):
+                pass
+
+    def _add_seeds_chunks(self, seeds):
+        seeds = iter(seeds)
+        while True:
+            with self.timer('convert/seeds'):
+                frontier_seeds = self.request_converter.to_frontier_many(islice(seeds, self.seeds_chunk_size))
+            if not frontier_seeds:
+                break
+            self._write('add_seeds', frontier_seeds)
+            self.stats.inc_value('scrapyfrontera/seeds_count', len(frontier_seeds))
+            self.stats.inc_value('scrapyfrontera/seeds_chunks_count')
+            yield
+
+    def _seeding_failed(self, failure):
+        if not failure.check(task.TaskStopped):
+            LOG.error('Error while adding seeds to frontier', exc_info=failure_to_exc_info(failure))
+
+    def _seeding_finished(self, _):
+        self._seeding_task = None
 
     def get_next_requests(self, max_next_requests=0, **kwargs):
-        frontier_requests = self.manager.get_next_requests(max_next_requests=max_next_requests, **kwargs)
-        return [self.request_converter.from_frontier(frontier_request) for frontier_request in frontier_requests]
+        frontier_requests = self.get_next_frontier_requests(max_next_requests=max_next_requests, **kwargs)
+        return self._from_frontier_requests(frontier_requests)
+
+    def get_next_requests_in_thread(self, max_next_requests=0, convert=True, **kwargs):
+        """
+        Same as get_next_requests(), but the backend is queried from the backend worker thread, or asynchronously for
+        asynchronous backends. Requires asynchronous backend calls, which prefetching enables. Returns a deferred which
+        fires in the reactor thread with the already converted scrapy requests, or with the frontier requests if
+        convert is False.
+        """
+        dfd = self._get_next_frontier_requests_async(max_next_requests=max_next_requests, **kwargs)
+        if convert:
+            dfd.addCallback(self._from_frontier_requests)
+        return dfd
+
+    def get_next_frontier_requests(self, max_next_requests=0, **kwargs):
+        """
+        Same as get_next_requests(), but returns the frontier requests, without converting them.
+        """
+        if self.consumer_slots is not None:
+            frontier_requests = self._get_next_slots_requests(max_next_requests, **kwargs)
+        else:
+            frontier_requests = self._call_backend('get_next_requests', max_next_requests=max_next_requests, **kwargs)
+        return self._next_requests_returned(frontier_requests, max_next_requests)
+
+    def _get_next_frontier_requests_async(self, max_next_requests=0, **kwargs):
+        if self.consumer_slots is None:
+            dfd = self._call_backend('get_next_requests', max_next_requests=max_next_requests, **kwargs)
+        else:
+            dfds = []
+            for slot, slot_max_next_requests in self.consumer_slots.allocate(
+                max_next_requests or self.manager.max_next_requests
+            ):
+                slot_dfd = self._call_backend(
+                    'get_next_requests', max_next_requests=slot_max_next_requests, consumer_slot=slot, **kwargs
+                )
+                slot_dfd.addCallback(self._slot_requests_returned, slot, slot_max_next_requests)
+                dfds.append(slot_dfd)
+            dfd = defer.gatherResults(dfds, consumeErrors=True)
+            dfd.addCallback(lambda results: sum(results, []))
+        dfd.addCallback(self._next_requests_returned, max_next_requests)
+        return dfd
+
+    def _next_requests_returned(self, frontier_requests, max_next_requests):
+        if self.timings is not None:
+            self.stats.inc_value(
+                'scrapyfrontera/batch_requested_count', max_next_requests or self.manager.max_next_requests
+            )
+            self.stats.inc_value('scrapyfrontera/batch_returned_count', len(frontier_requests))
+        return frontier_requests
+
+    def _get_next_slots_requests(self, max_next_requests, **kwargs):
+        """
+        Reads the next requests from the consumer slots, spreading the batch across the available ones. Requests are
+        tagged with their slot, so crawled pages and errors are reported to the same slot.
+        """
+        frontier_requests = []
+        for slot, slot_max_next_requests in self.consumer_slots.allocate(
+            max_next_requests or self.manager.max_next_requests
+        ):
+            slot_requests = self._call_backend(
+                'get_next_requests', max_next_requests=slot_max_next_requests, consumer_slot=slot, **kwargs
+            )
+            frontier_requests.extend(self._slot_requests_returned(slot_requests, slot, slot_max_next_requests))
+        return frontier_requests
+
+    def _slot_requests_returned(self, slot_requests, slot, slot_max_next_requests):
+        self.consumer_slots.record(slot, slot_max_next_requests, len(slot_requests))
+        self.stats.inc_value('scrapyfrontera/consumer_slot/%s/returned_count' % slot, len(slot_requests))
+        if not slot_requests:
+            self.stats.inc_value('scrapyfrontera/consumer_slot/%s/backoff_count' % slot)
+        for frontier_request in slot_requests:
+            frontier_request.meta[b'frontier_consumer_slot'] = slot
+        return slot_requests
+
+    def _from_frontier_requests(self, frontier_requests):
+        with self.timer('convert/next_requests'):
+            return [self.request_converter.from_frontier(frontier_request) for frontier_request in frontier_requests]
 
     def page_crawled(self, response):
-        frontier_response = self.response_converter.to_frontier(response)
-        self.manager.page_crawled(frontier_response)
+        with self.timer('convert/response'):
+            frontier_response = self.response_converter.to_frontier(response)
+        self._call_backend_write(
+            'page_crawled', frontier_response, consumer_slot=response.meta.get('frontier_consumer_slot')
+        )
 
     def links_extracted(self, request, links):
-        frontera_request = self.request_converter.to_frontier(request)
-        frontera_links = [self.request_converter.to_frontier(link) for link in links]
-        self.manager.links_extracted(frontera_request, frontera_links)
+        if self._links_dedup is not None:
+            links = self._dedup_links(links)
+            if not links:
+                return
+        if self.convert_in_thread_threshold and len(links) >= self.convert_in_thread_threshold:
+            self._convert_links_in_thread(self.request_converter.to_frontier(request), links)
+            return
+        with self.timer('convert/links'):
+            frontera_request = self.request_converter.to_frontier(request)
+            frontera_links = self.request_converter.to_frontier_many(links)
+        self._send_links(frontera_request, frontera_links)
+
+    def _send_links(self, frontera_request, frontera_links):
+        if self.links_buffering:
+            self._buffer_links(frontera_request, frontera_links)
+        else:
+            self._write('links_extracted', frontera_request, frontera_links)
+
+    def _convert_links_in_thread(self, frontera_request, links):
+        """
+        Converts a large batch of links in a worker thread, so the reactor is not blocked meanwhile. The worker thread
+        doesn't modify any data shared with the reactor thread, see RequestConverter.to_frontier_many_detached(). Links
+        are sent once converted. If the manager is stopped before, they are converted and sent synchronously instead.
+        """
+        key = next(self._conversions_counter)
+        self._conversions[key] = (frontera_request, links)
+        dfd = threads.deferToThread(
+            self.request_converter.to_frontier_many_detached, links, self.request_converter.snapshot()
+        )
+        dfd.addCallback(self._links_converted, key)
+        dfd.addErrback(self._links_conversion_failed, key)
+        self.stats.inc_value('scrapyfrontera/links_converted_in_thread_count', len(links))
+
+    def _links_converted(self, result, key):
+        frontera_links = self.request_converter.finish_detached(result)
+        if key in self._conversions:
+            frontera_request, _ = self._conversions.pop(key)
+            self._send_links(frontera_request, frontera_links)
+
+    def _links_conversion_failed(self, failure, key):
+        self._conversions.pop(key, None)
+        LOG.error('Error while converting links for frontier', exc_info=failure_to_exc_info(failure))
+
+    def flush_links(self):
+        """
+        Sends all buffered links to the backend in a single links_extracted() call.
+        """
+        if not self._links_buffer:
+            return
+        request, links = self._links_buffer_request, self._links_buffer
+        self._links_buffer_request = None
+        self._links_buffer = []
+        self._links_buffer_bytes = 0
+        start = time.time()
+        self._write('links_extracted', request, links)
+        elapsed = time.time() - start
+        self.stats.inc_value('scrapyfrontera/links_flush_count')
+        self.stats.inc_value('scrapyfrontera/links_flushed_count', len(links))
+        self.stats.inc_value('scrapyfrontera/links_flush_time', elapsed, start=0.0)
+        self.stats.max_value('scrapyfrontera/links_flush_max_time', elapsed)
+
+    def _dedup_links(self, links):
+        """
+        Filters out links already sent to the frontier by this process. Requests with dont_filter are never filtered.
+        """
+        unique_links = []
+        for link in links:
+            if link.dont_filter or not self._links_dedup.add(self.request_converter.fingerprint(link)):
+                unique_links.append(link)
+        suppressed = len(links) - len(unique_links)
+        if suppressed:
+            self.stats.inc_value('scrapyfrontera/links_dedup_suppressed_count', suppressed)
+        return unique_links
+
+    def _buffer_links(self, request, links):
+        if self._links_buffer_request is None:
+            self._links_buffer_request = request
+        self._links_buffer.extend(links)
+        self._links_buffer_bytes += sum(
+            len(link.url) + len(link.meta.get(b'scrapy_payload') or link.meta.get(b'scrapy_body') or b'')
+            for link in links
+        )
+        if self.links_buffer_size and len(self._links_buffer) >= self.links_buffer_size:
+            self.flush_links()
+        elif self.links_buffer_max_bytes and self._links_buffer_bytes >= self.links_buffer_max_bytes:
+            self.flush_links()
 
     def request_error(self, request, error):
-        self.manager.request_error(request=self.request_converter.to_frontier(request),
-                                   error=error)
+        """
+        If FRONTERA_SCHEDULER_REPORTED_ERRORS is set, only errors of those exception classes are sent to the
+        backend. If any of the FRONTERA_SCHEDULER_ERRORS_BUFFER_* settings is set, errors are buffered and aggregated
+        per fingerprint and exception class, see flush_errors().
+        """
+        self.stats.inc_value('scrapyfrontera/request_error/%s_count' % error)
+        if self.reported_errors and error not in self.reported_errors:
+            self.stats.inc_value('scrapyfrontera/request_errors_filtered_count')
+            return
+        if not self.errors_buffering:
+            with self.timer('convert/request_error'):
+                frontier_request = self.request_converter.to_frontier(request)
+            self._write('request_error', frontier_request, error,
+                        consumer_slot=request.meta.get('frontier_consumer_slot'))
+            return
+        key = (self.request_converter.fingerprint(request), error)
+        if key in self._errors_buffer:
+            self._errors_buffer[key][1] += 1
+            self.stats.inc_value('scrapyfrontera/request_errors_aggregated_count')
+            return
+        self._errors_buffer[key] = [request, 1]
+        if self.errors_buffer_size and len(self._errors_buffer) >= self.errors_buffer_size:
+            self.flush_errors()
+
+    def flush_errors(self):
+        """
+        Sends buffered errors to the backend, one request_error() call per fingerprint and exception class. Requests
+        are converted in a single pass, and the number of aggregated errors is set in meta b'frontier_error_count'.
+        """
+        if not self._errors_buffer:
+            return
+        errors, self._errors_buffer = self._errors_buffer, {}
+        with self.timer('convert/request_error'):
+            frontier_requests = self.request_converter.to_frontier_many(
+                (request for request, _ in errors.values()), embed_state=False
+            )
+        for ((_, error), (request, error_count)), frontier_request in zip(errors.items(), frontier_requests):
+            frontier_request.meta[b'frontier_error_count'] = error_count
+            self._write('request_error', frontier_request, error,
+                        consumer_slot=request.meta.get('frontier_consumer_slot'))
+        self.stats.inc_value('scrapyfrontera/request_errors_flush_count')
+        self.stats.inc_value('scrapyfrontera/request_errors_flushed_count', len(errors))
+
+    def return_requests(self, requests):
+        """
+        Hands back to the frontier requests read from it which were not crawled, so they are not lost when the spider
+        closes. Requests read from a consumer slot are returned to that slot. If the backend fails, requests are saved
+        to FRONTERA_SCHEDULER_RETURN_REQUESTS_FILE if set, and sent as seeds on the next run. Requests which can't be
+        converted are logged and skipped.
+        """
+        requests_by_slot = {}
+        for request in requests:
+            try:
+                frontier_request = self.request_converter.to_frontier(request)
+            except Exception:
+                LOG.warning('Could not convert %s to return it to frontier', request, exc_info=True)
+                self.stats.inc_value('scrapyfrontera/returned_on_close_failed_count')
+                continue
+            requests_by_slot.setdefault(request.meta.get('frontier_consumer_slot'), []).append(frontier_request)
+        for consumer_slot, frontier_requests in requests_by_slot.items():
+            if self.manager is None:
+                self._save_returned_requests(frontier_requests)
+                continue
+            try:
+                result = self._call_backend('return_requests', frontier_requests, consumer_slot=consumer_slot)
+            except Exception:
+                LOG.exception('Error while returning requests to frontier')
+                self._save_returned_requests(frontier_requests)
+            else:
+                if isinstance(result, defer.Deferred):
+                    result.addErrback(self._returning_requests_failed, frontier_requests)
+            self.stats.inc_value('scrapyfrontera/returned_on_close_count', len(frontier_requests))
+
+    def _returning_requests_failed(self, failure, frontier_requests):
+        LOG.error('Error while returning requests to frontier', exc_info=failure_to_exc_info(failure))
+        self._save_returned_requests(frontier_requests)
+
+    def _save_returned_requests(self, frontier_requests):
+        if not self.return_requests_file:
+            LOG.error('%d requests could not be returned to frontier and are lost', len(frontier_requests))
+            return
+        with open(self.return_requests_file, 'ab') as f:
+            pickle.dump(frontier_requests, f, protocol=FrontierSpool.pickle_protocol)
+        self.stats.inc_value('scrapyfrontera/returned_on_close_saved_count', len(frontier_requests))
+
+    def _add_saved_requests(self):
+        """
+        Sends as seeds the requests saved by a previous run because they could not be returned to the frontier.
+        """
+        frontier_requests = []
+        with open(self.return_requests_file, 'rb') as f:
+            while True:
+                try:
+                    frontier_requests.extend(pickle.load(f))
+                except EOFError:
+                    break
+        if frontier_requests:
+            self._write('add_seeds', frontier_requests)
+        os.remove(self.return_requests_file)
+        self.stats.inc_value('scrapyfrontera/returned_requests_loaded_count', len(frontier_requests))
+        LOG.info('Sent %d requests saved by previous run to frontier', len(frontier_requests))
+
+    def _drain_spool(self):
+        """
+        Sends spooled segments to the backend from the backend worker thread, oldest first, until the spool is empty
+        or FRONTERA_SCHEDULER_SPOOL_DRAIN_INTERVAL seconds have passed. Nothing is sent while the frontier is starting.
+        """
+        self._update_spool_stats()
+        if self._spool_draining is not None or self.manager is None:
+            return
+        self._spool_draining = defer.Deferred()
+        self._drain_spool_segment(time.time() + self.spool_drain_interval)
+
+    def _drain_spool_segment(self, deadline):
+        name, records = self.spool.next_segment()
+        if name is None or time.time() >= deadline or not self._spool_task.running:
+            self._spool_drain_finished()
+            return
+        dfd = self._send_spooled(records)
+        dfd.addCallback(self._spooled_sent, name, len(records))
+        # next segment is sent in a later reactor iteration, so calls which fire right away don't nest
+        dfd.addCallbacks(lambda _: reactor.callLater(0, self._drain_spool_segment, deadline),
+                         self._spooled_failed, errbackArgs=(name,))
+
+    def _send_spooled(self, records):
+        """
+        Sends spooled records to the backend. Consecutive links_extracted and add_seeds records are merged into a
+        single call (the list of links or seeds is always the last argument). Records of writes to a consumer slot carry
+        the slot as third item. If backend calls are asynchronous (always the case with a spool), returns a
+        deferred which fires when all calls finish.
+        """
+        batch = None
+        results = []
+        for record in records:
+            method_name, args, consumer_slot = record if len(record) == 3 else record + (None,)
+            if batch is not None and batch[0] == method_name and method_name in ('links_extracted', 'add_seeds'):
+                batch[1][-1] = batch[1][-1] + list(args[-1])
+                continue
+            if batch is not None:
+                results.append(self._call_backend(batch[0], *batch[1], consumer_slot=batch[2]))
+            batch = [method_name, list(args), consumer_slot]
+        if batch is not None:
+            results.append(self._call_backend(batch[0], *batch[1], consumer_slot=batch[2]))
+        if self.asynchronous:
+            return defer.gatherResults(results, consumeErrors=True)
+
+    def _spooled_sent(self, _, name, count):
+        self.spool.ack(name)
+        self.stats.inc_value('scrapyfrontera/spool_drained_count', count)
+        self._update_spool_stats()
+
+    def _spooled_failed(self, failure, name):
+        LOG.error('Error while sending spool segment %s to frontier, will retry', name,
+                  exc_info=failure_to_exc_info(failure))
+        self._spool_drain_finished()
+
+    def _spool_drain_finished(self):
+        dfd, self._spool_draining = self._spool_draining, None
+        dfd.callback(None)
+
+    def _update_spool_stats(self):
+        self.stats.set_value('scrapyfrontera/spool_depth', self.spool.depth)
+        self.stats.set_value('scrapyfrontera/spool_lag', self.spool.lag)
+
+    def _close_spool(self):
+        """
+        Stops draining, and sends the remaining segments if FRONTERA_SCHEDULER_SPOOL_DRAIN_ON_CLOSE is enabled. If a
+        drain is in progress, or backend calls are asynchronous, returns a deferred which fires when the spool closes.
+        """
+        if self._spool_task is not None and self._spool_task.running:
+            self._spool_task.stop()
+        if self._spool_draining is not None:
+            dfd = defer.Deferred()
+            self._spool_draining.addCallback(lambda _: self._finish_spool()).chainDeferred(dfd)
+            return dfd
+        return self._finish_spool()
+
+    def _finish_spool(self):
+        results = []
+        if self.spool_drain_on_close and self.manager is not None:
+            exclude = set()
+            while True:
+                name, records = self.spool.next_segment(exclude=exclude)
+                if name is None:
+                    break
+                exclude.add(name)
+                try:
+                    result = self._send_spooled(records)
+                except Exception:
+                    LOG.exception('Error while sending spool segment %s to frontier, will be sent on next run', name)
+                    break
+                if result is None:
+                    self._spooled_sent(None, name, len(records))
+                else:
+                    result.addCallback(self._spooled_sent, name, len(records))
+                    result.addErrback(self._log_spool_error, name)
+                    results.append(result)
+        if results:
+            return defer.DeferredList(results).addCallback(lambda _: self._spool_closed())
+        self._spool_closed()
+
+    def _log_spool_error(self, failure, name):
+        LOG.error('Error while sending spool segment %s to frontier, will be sent on next run', name,
+                  exc_info=failure_to_exc_info(failure))
+
+    def _spool_closed(self):
+        self.spool.close()
+        self._update_spool_stats()
+
+
+def _write_weight(method_name, args):
+    """
+    Number of requests sent by a backend call: the links or seeds of batched writes, none for reads, one otherwise.
+    """
+    if method_name in ('links_extracted', 'add_seeds'):
+        return len(args[-1])
+    if method_name == 'get_next_requests':
+        return 0
+    return 1
+
+
+def _spool_record_weight(record):
+    return _write_weight(record[0], record[1])
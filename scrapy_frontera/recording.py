@@ -0,0 +1,70 @@
+import gzip
+import time
+import pickle
+import logging
+import threading
+from collections import namedtuple
+
+
+LOG = logging.getLogger(__name__)
+
+
+RecordedCall = namedtuple('RecordedCall', 'method consumer_slot args result error start duration')
+
+
+class FrontierRecorder(object):
+    """
+    Streams frontier backend calls to a gzip compressed file, as a sequence of pickled records with the method name,
+    consumer slot, arguments, result (or error representation), start time and duration of each call. Arguments are
+    serialized when the call starts, so later changes done by the backend are not recorded. Calls may finish in
+    different threads, so records are written holding a lock.
+    """
+
+    pickle_protocol = 4
+
+    def __init__(self, path, compresslevel=6):
+        self.path = path
+        self.count = 0
+        self._file = gzip.open(path, 'wb', compresslevel=compresslevel)
+        self._lock = threading.Lock()
+
+    def start(self, method_name, args, consumer_slot=None):
+        """
+        Returns a token to pass to finish() when the call ends.
+        """
+        return method_name, consumer_slot, pickle.dumps(args, protocol=self.pickle_protocol), time.time()
+
+    def finish(self, token, result=None, error=None):
+        method_name, consumer_slot, args, start = token
+        record = (method_name, consumer_slot, args, result, error, start, time.time() - start)
+        try:
+            data = pickle.dumps(record, protocol=self.pickle_protocol)
+        except Exception:
+            LOG.warning('Could not record frontier %s call', method_name, exc_info=True)
+            return
+        with self._lock:
+            if self._file.closed:
+                LOG.warning('Frontier %s call finished after the recording was closed', method_name)
+                return
+            self._file.write(data)
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_recording(path):
+    """
+    Yields the :class:`RecordedCall` records of a recording, in the order they finished.
+    """
+    with gzip.open(path, 'rb') as f:
+        while True:
+            try:
+                method_name, consumer_slot, args, result, error, start, duration = pickle.load(f)
+            except EOFError:
+                break
+            except (pickle.UnpicklingError, OSError):
+                LOG.warning('Truncated record found in recording %s, ignoring the rest of it', path)
+                break
+            yield RecordedCall(method_name, consumer_slot, pickle.loads(args), result, error, start, duration)
@@ -1,11 +1,23 @@
+import os
 import json
+import time
+import pickle
 import logging
 
+from twisted.internet import task
+from twisted.internet.defer import CancelledError
+
+from queuelib.queue import FifoDiskQueue
+
 from scrapy.core.scheduler import Scheduler
 from scrapy.http import Request
+from scrapy.utils.job import job_dir
+from scrapy.utils.log import failure_to_exc_info
 
 from frontera.contrib.scrapy.settings_adapter import ScrapySettingsAdapter
+from .batching import AdaptiveBatchSize
 from .manager import ScrapyFrontierManager
+from .slots import OverusedSlotsTracker, SlotBuffer
 from .utils import get_callback_name
 
 
@@ -14,17 +26,88 @@ LOG = logging.getLogger(__name__)
 
 class FronteraScheduler(Scheduler):
 
+    lazy_queue_pickle_protocol = 4
+
     @classmethod
     def from_crawler(cls, crawler):
         obj = super(FronteraScheduler, cls).from_crawler(crawler)
         obj.crawler = crawler
         obj.frontier = None
+        obj.page_crawled_frontier_only = crawler.settings.getbool('FRONTERA_SCHEDULER_PAGE_CRAWLED_FRONTIER_ONLY')
+        obj.prefetch = crawler.settings.getbool('FRONTERA_SCHEDULER_PREFETCH')
+        obj.prefetch_low_watermark = crawler.settings.getint('FRONTERA_SCHEDULER_PREFETCH_LOW_WATERMARK', 100)
+        obj._prefetch_dfd = None
+        obj.batch_size = None
+        if crawler.settings.getbool('FRONTERA_SCHEDULER_ADAPTIVE_BATCH_SIZE'):
+            obj.batch_size = AdaptiveBatchSize(
+                min_size=crawler.settings.getint('FRONTERA_SCHEDULER_ADAPTIVE_BATCH_SIZE_MIN', 16),
+                max_size=crawler.settings.getint('FRONTERA_SCHEDULER_ADAPTIVE_BATCH_SIZE_MAX', 1024),
+                target_seconds=crawler.settings.getfloat('FRONTERA_SCHEDULER_ADAPTIVE_BATCH_SIZE_TARGET', 10.0),
+            )
+        obj.backpressure_high_watermark = crawler.settings.getint('FRONTERA_SCHEDULER_BACKPRESSURE_HIGH_WATERMARK')
+        obj.backpressure_low_watermark = crawler.settings.getint(
+            'FRONTERA_SCHEDULER_BACKPRESSURE_LOW_WATERMARK', obj.backpressure_high_watermark // 2
+        )
+        obj.backpressure_interval = crawler.settings.getfloat('FRONTERA_SCHEDULER_BACKPRESSURE_INTERVAL', 1.0)
+        obj._backpressure_task = None
+        obj._paused_since = None
+        obj.slot_buffer_size = crawler.settings.getint('FRONTERA_SCHEDULER_SLOT_BUFFER_SIZE')
+        obj.slot_buffer = None
+        obj.lazy_queue_enabled = crawler.settings.getbool('FRONTERA_SCHEDULER_LAZY_DISK_QUEUE')
+        obj.lazy_queue = None
+        obj.background_start = crawler.settings.getbool('FRONTERA_SCHEDULER_BACKGROUND_START')
+        obj._open_time = None
+        obj.return_requests_on_close = crawler.settings.getbool('FRONTERA_SCHEDULER_RETURN_REQUESTS_ON_CLOSE')
         return obj
 
     def next_request(self):
-        if not self.has_pending_requests():
+        if self.slot_buffer:
+            self._release_slot_buffer()
+        if self.prefetch or self.frontier.asynchronous:
+            self._prefetch_requests_from_backend()
+        elif not self._has_pending_requests():
             self._get_requests_from_backend()
-        return super(FronteraScheduler, self).next_request()
+        request = super(FronteraScheduler, self).next_request()
+        if request is None and self.lazy_queue is not None:
+            request = self._pop_lazy_queue()
+        if request is not None:
+            if self.batch_size is not None:
+                self.batch_size.request_dequeued()
+            if self._open_time is not None:
+                self.stats.set_value('scrapyfrontera/time_to_first_request', time.time() - self._open_time)
+                self._open_time = None
+        return request
+
+    def __len__(self):
+        length = super(FronteraScheduler, self).__len__()
+        if self.lazy_queue is not None:
+            length += len(self.lazy_queue)
+        return length
+
+    def has_pending_requests(self):
+        """
+        The spider is not idle while the frontier is still receiving seeds or links, or frontier calls are in progress,
+        even if no request is queued yet.
+        """
+        return (
+            self._has_pending_requests()
+            or bool(self.slot_buffer)
+            or self.frontier.seeding
+            or self.frontier.converting
+            or self.frontier.calling
+        )
+
+    def _has_pending_requests(self):
+        """
+        Whether next_request() must not read from the backend, because requests are queued or being read. Frontier
+        activity that only matters for idleness (see has_pending_requests()) must not block reads. Requests held in
+        the slot buffer are not taken into account either, as they must not prevent reading requests for other slots.
+        """
+        return (
+            super(FronteraScheduler, self).has_pending_requests()
+            or self._prefetch_dfd is not None
+            or self.frontier.starting
+        )
 
     def is_frontera_request(self, request):
         """
@@ -43,10 +126,12 @@ class FronteraScheduler(Scheduler):
                 links.append(element)
             else:
                 yield element
-        self.frontier.page_crawled(response)
+        if not self.page_crawled_frontier_only or self.frontier.request_converter.is_from_frontier(response.request):
+            self.frontier.page_crawled(response)
         if links:
             self.frontier.links_extracted(response.request, links)
             self.stats.inc_value('scrapyfrontera/links_extracted_count', len(links))
+            self._check_backpressure()
 
     def process_exception(self, request, exception, spider):
         error_code = self._get_exception_code(exception)
@@ -54,14 +139,23 @@ class FronteraScheduler(Scheduler):
             self.frontier.request_error(request=request, error=error_code)
 
     def open(self, spider):
+        self._open_time = time.time()
         super(FronteraScheduler, self).open(spider)
         frontera_settings = ScrapySettingsAdapter(spider.crawler.settings)
         frontera_settings.set_from_dict(getattr(spider, 'frontera_settings', {}))
         frontera_settings.set_from_dict(json.loads(getattr(spider, 'frontera_settings_json', '{}')))
         frontera_settings.set('STATS_MANAGER', self.stats)
-        self.frontier = ScrapyFrontierManager(frontera_settings)
+        self.frontier = ScrapyFrontierManager(frontera_settings, background_start=self.background_start)
 
         self.frontier.set_spider(spider)
+        self.overused_slots = OverusedSlotsTracker(self.crawler, frontera_settings.get('OVERUSED_SLOT_FACTOR'))
+        if self.slot_buffer_size:
+            self.slot_buffer = SlotBuffer(self.overused_slots, self.slot_buffer_size, self.stats)
+        if self.lazy_queue_enabled:
+            if self.dqdir:
+                self.lazy_queue = FifoDiskQueue(os.path.join(job_dir(self.crawler.settings), 'frontier.queue'))
+            else:
+                LOG.warning('FRONTERA_SCHEDULER_LAZY_DISK_QUEUE is enabled, but JOBDIR is not set. Ignoring it.')
 
         if self.crawler.settings.getbool('FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER'):
             self.frontier.add_seeds(spider.start_requests())
@@ -70,30 +164,213 @@ class FronteraScheduler(Scheduler):
             self.crawler.settings.getlist('FRONTERA_SCHEDULER_REQUEST_CALLBACKS_TO_FRONTIER')
 
         LOG.info('Starting frontier')
-        if not self.frontier.manager.auto_start:
+        if self.background_start:
+            dfd = self.frontier.start_in_background()
+            dfd.addCallbacks(self._frontier_started, self._frontier_failed)
+        elif not self.frontier.manager.auto_start:
             self.frontier.start()
 
     def close(self, reason):
+        if self.frontier.starting:
+            LOG.info('Waiting for frontier to start before closing')
+            return self.frontier.when_started().addCallback(lambda _: self.close(reason))
+        if self._prefetch_dfd is not None:
+            if self.return_requests_on_close:
+                # requests being read must be returned too
+                return self._prefetch_dfd.addBoth(lambda _: self.close(reason))
+            self._prefetch_dfd.cancel()
+        if self._paused_since is not None:
+            self._resume_engine()
+        if self.return_requests_on_close:
+            self._return_requests()
         super(FronteraScheduler, self).close(reason)
+        if self.lazy_queue is not None:
+            self.lazy_queue.close()
         LOG.info('Finishing frontier (%s)' % reason)
-        self.frontier.stop()
+        dfd = self.frontier.stop()
+        if dfd is not None:
+            return dfd.addCallback(lambda _: self.df.close(reason))
         return self.df.close(reason)
 
+    def _frontier_started(self, _):
+        LOG.info('Frontier started')
+        # wake up the engine, it may be idle waiting for new requests
+        self.crawler.engine.slot.nextcall.schedule()
+
+    def _frontier_failed(self, failure):
+        self.crawler.engine.close_spider(self.spider, 'frontier_error')
+
+    def _backend_available(self):
+        return self.frontier.ready and not self.frontier.finished
+
     def _get_requests_from_backend(self):
-        if not self.frontier.manager.finished:
+        if self._backend_available():
             info = self._get_downloader_info()
-            requests = self.frontier.get_next_requests(key_type=info['key_type'], overused_keys=info['overused_keys'])
-            for request in requests:
-                if request.errback is None and hasattr(self.spider, 'errback'):
-                    request.errback = self.spider.errback
-                    request.callback = request.callback or self.spider.parse
-                if hasattr(self.spider, 'preprocess_request_from_frontier'):
-                    request = self.spider.preprocess_request_from_frontier(request)
-                if request is None:
-                    self.stats.inc_value('scrapyfrontera/ignored_requests_count')
-                else:
-                    self.enqueue_request(request)
-                    self.stats.inc_value('scrapyfrontera/returned_requests_count')
+            start = time.time()
+            get_next_requests = self.frontier.get_next_requests
+            if self.lazy_queue is not None:
+                get_next_requests = self.frontier.get_next_frontier_requests
+            requests = get_next_requests(
+                max_next_requests=self._get_max_next_requests(),
+                key_type=info['key_type'],
+                overused_keys=info['overused_keys'],
+            )
+            self._backend_called(time.time() - start)
+            self._enqueue_requests_from_backend(requests)
+
+    def _get_max_next_requests(self):
+        """
+        0 means the backend default, MAX_NEXT_REQUESTS frontera setting.
+        """
+        if self.batch_size is None:
+            return 0
+        size = self.batch_size.next_size(len(self))
+        self.stats.set_value('scrapyfrontera/adaptive_batch_size', size)
+        self.stats.set_value('scrapyfrontera/adaptive_dequeue_rate', self.batch_size.dequeue_rate)
+        return size
+
+    def _backend_called(self, elapsed):
+        if self.batch_size is not None:
+            self.batch_size.backend_called(elapsed)
+            self.stats.set_value('scrapyfrontera/adaptive_backend_latency', self.batch_size.backend_latency)
+
+    def _prefetch_requests_from_backend(self):
+        """
+        Reads the next batch from the backend in a worker thread (or asynchronously, if backend calls are asynchronous)
+        as soon as local queues drop below the low watermark, so the downloader doesn't need to wait for the frontier
+        round-trip.
+        """
+        if self._prefetch_dfd is not None or len(self) > self.prefetch_low_watermark:
+            return
+        if not self._backend_available():
+            return
+        info = self._get_downloader_info()
+        self._prefetch_dfd = self.frontier.get_next_requests_in_thread(max_next_requests=self._get_max_next_requests(),
+                                                                       key_type=info['key_type'],
+                                                                       overused_keys=info['overused_keys'],
+                                                                       convert=self.lazy_queue is None)
+        self._prefetch_dfd.addBoth(self._prefetch_finished, time.time())
+        self._prefetch_dfd.addCallback(self._enqueue_prefetched_requests)
+        self._prefetch_dfd.addErrback(self._prefetch_failed)
+
+    def _prefetch_finished(self, result, start):
+        self._prefetch_dfd = None
+        self._backend_called(time.time() - start)
+        return result
+
+    def _enqueue_prefetched_requests(self, requests):
+        self._enqueue_requests_from_backend(requests)
+        self.stats.inc_value('scrapyfrontera/prefetch_count')
+        # wake up the engine, it may be idle waiting for new requests
+        self.crawler.engine.slot.nextcall.schedule()
+
+    def _prefetch_failed(self, failure):
+        if not failure.check(CancelledError):
+            LOG.error('Error while prefetching requests from frontier', exc_info=failure_to_exc_info(failure))
+
+    def _enqueue_requests_from_backend(self, requests):
+        with self.frontier.timer('enqueue/next_requests'):
+            if self.lazy_queue is not None:
+                self._push_lazy_queue(requests)
+            else:
+                self._enqueue_frontier_requests(requests)
+
+    def _enqueue_frontier_requests(self, requests):
+        for request in requests:
+            request = self._prepare_frontier_request(request)
+            if request is not None and (self.slot_buffer is None or not self.slot_buffer.hold(request)):
+                self.enqueue_request(request)
+
+    def _prepare_frontier_request(self, request):
+        if request.errback is None and hasattr(self.spider, 'errback'):
+            request.errback = self.spider.errback
+            request.callback = request.callback or self.spider.parse
+        if hasattr(self.spider, 'preprocess_request_from_frontier'):
+            request = self.spider.preprocess_request_from_frontier(request)
+        if request is None:
+            self.stats.inc_value('scrapyfrontera/ignored_requests_count')
+        else:
+            self.stats.inc_value('scrapyfrontera/returned_requests_count')
+        return request
+
+    def _push_lazy_queue(self, frontier_requests):
+        """
+        Stores frontier requests as they are read from the backend. They are converted to scrapy requests only
+        when popped, so they are serialized just once and don't use memory while waiting. Scrapy disk queues only
+        accept scrapy requests in recent versions, so frontier requests are pickled here.
+        """
+        for frontier_request in frontier_requests:
+            self.lazy_queue.push(pickle.dumps(frontier_request, protocol=self.lazy_queue_pickle_protocol))
+        self.stats.inc_value('scrapyfrontera/lazy_queue_pushed_count', len(frontier_requests))
+
+    def _pop_lazy_queue(self):
+        while len(self.lazy_queue):
+            request = self.frontier.request_converter.from_frontier(pickle.loads(self.lazy_queue.pop()))
+            request = self._prepare_frontier_request(request)
+            if request is not None and (self.slot_buffer is None or not self.slot_buffer.hold(request)):
+                self.stats.inc_value('scheduler/dequeued', spider=self.spider)
+                return request
+
+    def _release_slot_buffer(self):
+        for request in self.slot_buffer.release():
+            self.enqueue_request(request)
+
+    def _return_requests(self):
+        """
+        Hands back to the frontier the requests read from it which remain in memory queues and in the slot buffer.
+        Other requests are put back in memory queues, and requests in disk queues are kept for the next run with the
+        same JOBDIR.
+        """
+        requests = []
+        other_requests = []
+        while True:
+            request = self.mqs.pop()
+            if request is None:
+                break
+            if self.frontier.request_converter.is_from_frontier(request):
+                requests.append(request)
+            else:
+                other_requests.append(request)
+        for request in other_requests:
+            self._mqpush(request)
+        if self.slot_buffer is not None:
+            requests.extend(self.slot_buffer.pop_all())
+        if requests:
+            LOG.info('Returning %d requests to frontier', len(requests))
+            self.frontier.return_requests(requests)
+
+    def _check_backpressure(self):
+        """
+        Pauses the engine when pending frontier writes reach the high watermark, so no more requests are
+        downloaded until the backend catches up.
+        """
+        if not self.backpressure_high_watermark or self._paused_since is not None:
+            return
+        pending = self.frontier.pending_writes
+        if pending < self.backpressure_high_watermark:
+            return
+        LOG.info('Pausing engine: %d pending frontier writes', pending)
+        self.crawler.engine.pause()
+        self._paused_since = time.time()
+        self.stats.inc_value('scrapyfrontera/backpressure_pause_count')
+        self._backpressure_task = task.LoopingCall(self._release_backpressure)
+        self._backpressure_task.start(self.backpressure_interval, now=False)
+
+    def _release_backpressure(self):
+        self.frontier.flush_links()
+        pending = self.frontier.pending_writes
+        if pending <= self.backpressure_low_watermark:
+            LOG.info('Resuming engine: %d pending frontier writes', pending)
+            self._resume_engine()
+            self.crawler.engine.slot.nextcall.schedule()
+
+    def _resume_engine(self):
+        if self._backpressure_task.running:
+            self._backpressure_task.stop()
+        self._backpressure_task = None
+        self.crawler.engine.unpause()
+        self.stats.inc_value('scrapyfrontera/backpressure_pause_time', time.time() - self._paused_since, start=0.0)
+        self._paused_since = None
 
     def _get_exception_code(self, exception):
         try:
@@ -102,13 +379,7 @@ class FronteraScheduler(Scheduler):
             return '?'
 
     def _get_downloader_info(self):
-        downloader = self.crawler.engine.downloader
-        info = {
-            'key_type': 'ip' if downloader.ip_concurrency else 'domain',
-            'overused_keys': []
+        return {
+            'key_type': self.overused_slots.key_type,
+            'overused_keys': self.overused_slots.get_overused_keys(),
         }
-        for key, slot in downloader.slots.items():
-            overused_factor = len(slot.active) / float(slot.concurrency)
-            if overused_factor > self.frontier.manager.settings.get('OVERUSED_SLOT_FACTOR'):
-                info['overused_keys'].append(key)
-        return info
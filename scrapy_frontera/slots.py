@@ -0,0 +1,149 @@
+from collections import deque
+
+from scrapy import signals
+
+
+class OverusedSlotsTracker(object):
+    """
+    Keeps the set of overused downloader slots up to date. Instead of checking every downloader slot on each
+    backend fetch, only the slots that had activity since the previous check, plus the ones already known
+    as overused, are checked again. Slots with activity are also collected for :class:`SlotBuffer`, see
+    pop_active_keys().
+    """
+
+    def __init__(self, crawler, overused_slot_factor):
+        self.crawler = crawler
+        self.overused_slot_factor = overused_slot_factor
+        self._dirty_keys = set()
+        self._overused_keys = set()
+        self._active_keys = set()
+        crawler.signals.connect(self._slot_activity, signal=signals.request_reached_downloader)
+        crawler.signals.connect(self._slot_activity, signal=signals.response_downloaded)
+        if hasattr(signals, 'request_left_downloader'):
+            crawler.signals.connect(self._slot_activity, signal=signals.request_left_downloader)
+
+    @property
+    def downloader(self):
+        return self.crawler.engine.downloader
+
+    @property
+    def key_type(self):
+        return 'ip' if self.downloader.ip_concurrency else 'domain'
+
+    def _slot_activity(self, request, spider, **kwargs):
+        key = request.meta.get('download_slot')
+        if key is not None:
+            self._dirty_keys.add(key)
+            self._active_keys.add(key)
+
+    def pop_active_keys(self):
+        """
+        Returns the slots which had activity since the previous call.
+        """
+        keys, self._active_keys = self._active_keys, set()
+        return keys
+
+    def get_slot_key(self, request):
+        return self.downloader._get_slot_key(request, None)
+
+    def free_capacity(self, key):
+        """
+        Number of requests the slot can take before being overused, or None if the slot is not active.
+        """
+        slot = self.downloader.slots.get(key)
+        if slot is None:
+            return None
+        return max(int(slot.concurrency * self.overused_slot_factor) - len(slot.active), 0)
+
+    def is_overused(self, key):
+        slot = self.downloader.slots.get(key)
+        return slot is not None and len(slot.active) / float(slot.concurrency) > self.overused_slot_factor
+
+    def get_overused_keys(self):
+        for key in self._dirty_keys | self._overused_keys:
+            if self.is_overused(key):
+                self._overused_keys.add(key)
+            else:
+                self._overused_keys.discard(key)
+        self._dirty_keys.clear()
+        return list(self._overused_keys)
+
+
+class SlotBuffer(object):
+    """
+    Holds requests read from the frontier which target overused downloader slots, and releases them when their
+    slot has capacity again, so they don't block scheduler queues while other slots are idle. Once the buffer holds
+    max_size requests, new requests are not held anymore. A slot only gets capacity when its requests leave the
+    downloader, so only slots with activity since the previous release are checked.
+    """
+
+    def __init__(self, tracker, max_size, stats):
+        self.tracker = tracker
+        self.max_size = max_size
+        self.stats = stats
+        self._requests = {}
+        self._size = 0
+        self._dirty_keys = set()
+
+    def __len__(self):
+        return self._size
+
+    def hold(self, request):
+        """
+        Returns True if the request has been held. Requests for slots which already have held requests are held too,
+        in order to keep their order.
+        """
+        if self._size >= self.max_size:
+            return False
+        key = self.tracker.get_slot_key(request)
+        if key not in self._requests and not self.tracker.is_overused(key):
+            return False
+        self._requests.setdefault(key, deque()).append(request)
+        self._size += 1
+        self._update_stats(key)
+        return True
+
+    def release(self):
+        """
+        Returns the held requests whose slot is not overused anymore, up to the slot free capacity. Slots which still
+        hold requests after a release are checked again on next call, even without activity.
+        """
+        self._dirty_keys |= self.tracker.pop_active_keys()
+        keys = [key for key in self._dirty_keys if key in self._requests]
+        self._dirty_keys.clear()
+        released = []
+        for key in keys:
+            if self.tracker.is_overused(key):
+                continue
+            requests = self._requests[key]
+            capacity = self.tracker.free_capacity(key)
+            count = len(requests) if capacity is None else min(max(capacity, 1), len(requests))
+            released.extend(requests.popleft() for _ in range(count))
+            if requests:
+                self._dirty_keys.add(key)
+            else:
+                del self._requests[key]
+            self._size -= count
+            self._update_stats(key)
+        return released
+
+    def pop_all(self):
+        """
+        Returns all held requests, and empties the buffer.
+        """
+        requests = []
+        for key in list(self._requests):
+            requests.extend(self._requests.pop(key))
+            self._update_stats(key)
+        self._size = 0
+        self.stats.set_value('scrapyfrontera/slot_buffer_size', 0)
+        return requests
+
+    def _update_stats(self, key):
+        stat = 'scrapyfrontera/slot_buffer/%s' % key
+        if key in self._requests:
+            self.stats.set_value(stat, len(self._requests[key]))
+        else:
+            # scrapy stats collectors have no way to remove a key other than editing the stats dict
+            self.stats.get_stats().pop(stat, None)
+        self.stats.set_value('scrapyfrontera/slot_buffer_size', self._size)
@@ -0,0 +1,122 @@
+import os
+import time
+import pickle
+import logging
+from collections import deque
+
+
+LOG = logging.getLogger(__name__)
+
+
+class FrontierSpool(object):
+    """
+    Append-only spool of frontier writes, stored in segment files inside the given folder. Each record is
+    pickled along with its creation time. Segments are drained in order, and removed once acknowledged, so segments
+    left by a previous run are replayed. If given, weigh is called with each record to compute the spool weight.
+    """
+
+    pickle_protocol = 4
+    segment_suffix = '.spool'
+
+    def __init__(self, path, segment_size=1000, weigh=None):
+        self.path = path
+        self.segment_size = segment_size
+        self.weigh = weigh or (lambda record: 1)
+        os.makedirs(path, exist_ok=True)
+        self._segments = deque(sorted(name for name in os.listdir(path) if name.endswith(self.segment_suffix)))
+        self._segment_counts = {}
+        self._segment_weights = {}
+        self._oldest_times = {}
+        for name in self._segments:
+            records = self.read_segment(name)
+            self._segment_counts[name] = len(records)
+            self._segment_weights[name] = sum(self.weigh(record) for _, record in records)
+            if records:
+                self._oldest_times[name] = records[0][0]
+        self._next_segment = int(self._segments[-1][:-len(self.segment_suffix)]) + 1 if self._segments else 0
+        self._current = None
+        self._current_name = None
+
+    @property
+    def depth(self):
+        """Number of records not acknowledged yet"""
+        return sum(self._segment_counts.values())
+
+    @property
+    def weight(self):
+        """Total weight of the records not acknowledged yet"""
+        return sum(self._segment_weights.values())
+
+    @property
+    def lag(self):
+        """Age in seconds of the oldest record not acknowledged yet"""
+        if not self._oldest_times:
+            return 0.0
+        return time.time() - min(self._oldest_times.values())
+
+    def append(self, record):
+        """
+        Appends a record. Raises pickle errors if the record can't be serialized.
+        """
+        data = pickle.dumps((time.time(), record), protocol=self.pickle_protocol)
+        if self._current is None or self._segment_counts[self._current_name] >= self.segment_size:
+            self._rotate()
+        self._current.write(data)
+        self._current.flush()
+        self._segment_counts[self._current_name] += 1
+        self._segment_weights[self._current_name] += self.weigh(record)
+        self._oldest_times.setdefault(self._current_name, time.time())
+
+    def _rotate(self):
+        self._close_current()
+        self._current_name = '%012d%s' % (self._next_segment, self.segment_suffix)
+        self._next_segment += 1
+        self._current = open(os.path.join(self.path, self._current_name), 'ab')
+        self._segments.append(self._current_name)
+        self._segment_counts[self._current_name] = 0
+        self._segment_weights[self._current_name] = 0
+
+    def _close_current(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+            self._current_name = None
+
+    def read_segment(self, name):
+        records = []
+        with open(os.path.join(self.path, name), 'rb') as f:
+            while True:
+                try:
+                    records.append(pickle.load(f))
+                except EOFError:
+                    break
+                except pickle.UnpicklingError:
+                    LOG.warning('Truncated record found in spool segment %s, ignoring the rest of it', name)
+                    break
+        return records
+
+    def next_segment(self, exclude=()):
+        """
+        Returns name and records of the oldest segment not in exclude, or (None, []) if there is none. The segment
+        being written is closed if needed, so new records go to a new one.
+        """
+        for name in self._segments:
+            if name in exclude:
+                continue
+            if name == self._current_name:
+                if not self._segment_counts[name]:
+                    break
+                self._close_current()
+            return name, [record for _, record in self.read_segment(name)]
+        return None, []
+
+    def ack(self, name):
+        """Removes a drained segment"""
+        self._segments.remove(name)
+        self._segment_counts.pop(name)
+        self._segment_weights.pop(name)
+        self._oldest_times.pop(name, None)
+        os.remove(os.path.join(self.path, name))
+
+    def close(self):
+        self._close_current()
@@ -0,0 +1,71 @@
+import time
+import pickle
+import logging
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+LOG = logging.getLogger(__name__)
+
+
+class StageTimings(object):
+    """
+    Records cumulative time, call count and latency percentiles of frontier hot path stages into scrapy stats,
+    under scrapyfrontera/timing/<stage>/ keys. Percentiles are computed over the last window samples of each
+    stage, and are only updated on update_percentiles() calls, in order to keep record() cheap.
+    """
+
+    def __init__(self, stats, window=1000):
+        self.stats = stats
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, stage, elapsed):
+        prefix = 'scrapyfrontera/timing/%s' % stage
+        self.stats.inc_value(prefix + '/count')
+        self.stats.inc_value(prefix + '/time', elapsed, start=0.0)
+        self.stats.max_value(prefix + '/max', elapsed)
+        self._samples[stage].append(elapsed)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(stage, time.time() - start)
+
+    def record_size(self, name, obj):
+        """
+        Records the pickled size of the given object, as an estimation of its serialized size.
+        """
+        try:
+            size = len(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return
+        prefix = 'scrapyfrontera/size/%s' % name
+        self.stats.inc_value(prefix + '/count')
+        self.stats.inc_value(prefix + '/total', size)
+        self.stats.max_value(prefix + '/max', size)
+
+    def update_percentiles(self):
+        for stage, samples in list(self._samples.items()):
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            prefix = 'scrapyfrontera/timing/%s' % stage
+            self.stats.set_value(prefix + '/p50', ordered[int(0.50 * (len(ordered) - 1))])
+            self.stats.set_value(prefix + '/p95', ordered[int(0.95 * (len(ordered) - 1))])
+
+    def log(self):
+        self.update_percentiles()
+        for stage in sorted(self._samples):
+            prefix = 'scrapyfrontera/timing/%s' % stage
+            LOG.info(
+                'Frontier stage %s: %d calls, %.3fs total, p50=%.4fs p95=%.4fs max=%.4fs',
+                stage,
+                self.stats.get_value(prefix + '/count', 0),
+                self.stats.get_value(prefix + '/time', 0.0),
+                self.stats.get_value(prefix + '/p50', 0.0),
+                self.stats.get_value(prefix + '/p95', 0.0),
+                self.stats.get_value(prefix + '/max', 0.0),
+            )
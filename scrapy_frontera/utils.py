@@ -1,5 +1,44 @@
+import math
+import hashlib
+
+from w3lib.util import to_bytes
+
+
 def get_callback_name(request):
     if request.callback is None:
         return 'parse'
     if hasattr(request.callback, '__func__'):
         return request.callback.__func__.__name__
+
+
+class BloomFilter(object):
+    """
+    Memory bounded probabilistic set of fingerprints. Membership checks may return false positives with
+    (approximately) the given error rate, as long as no more than capacity fingerprints are added.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, fingerprint):
+        digest = hashlib.sha1(to_bytes(fingerprint)).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, fingerprint):
+        """
+        Adds the fingerprint to the filter. Returns True if it was (probably) already there.
+        """
+        found = True
+        for position in self._positions(fingerprint):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & mask:
+                found = False
+                self.bits[byte] |= mask
+        return found
+
+    def __contains__(self, fingerprint):
+        return all(self.bits[position >> 3] & 1 << (position & 7) for position in self._positions(fingerprint))
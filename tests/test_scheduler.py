@@ -1,4 +1,10 @@
-from unittest.mock import patch
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+from unittest.mock import Mock, patch
 
 from twisted.trial.unittest import TestCase
 from twisted.internet import defer
@@ -6,9 +12,24 @@ from twisted.internet import defer
 from scrapy import Request, Spider
 from scrapy.http import Response
 from scrapy.settings import Settings
+from scrapy.utils.reqser import request_from_dict, request_to_dict
+from scrapy.utils.request import request_fingerprint
 from scrapy.utils.test import get_crawler
+from scrapy.core.scheduler import Scheduler
 from scrapy.crawler import CrawlerRunner
 
+from frontera.contrib.backends.memory import FIFO
+from frontera.contrib.scrapy.settings_adapter import ScrapySettingsAdapter
+
+from scrapy_frontera.batching import AdaptiveBatchSize
+from scrapy_frontera.consumer import ConsumerSlots
+from scrapy_frontera.converters import RequestConverter, ResponseConverter
+from scrapy_frontera.manager import ScrapyFrontierManager
+from scrapy_frontera.recording import FrontierRecorder, read_recording
+from scrapy_frontera.scheduler import FronteraScheduler
+from scrapy_frontera.slots import OverusedSlotsTracker, SlotBuffer
+from scrapy_frontera.spool import FrontierSpool
+
 
 TEST_SETTINGS = {
     'SCHEDULER': 'scrapy_frontera.scheduler.FronteraScheduler',
@@ -83,6 +104,41 @@ class TestSpider3(Spider):
         yield Request('http://example2.com')
 
 
+class TestSpider4(Spider):
+    name = 'test'
+    success = 0
+
+    def start_requests(self):
+        yield Request('http://example.com')
+
+    def parse(self, response):
+        self.success += 1
+        yield Request('http://example2.com')
+        yield Request('http://example2.com')
+        yield Request('http://example2.com', dont_filter=True)
+
+
+class TestSpider5(Spider):
+    name = 'test'
+    category = None
+
+    def start_requests(self):
+        yield Request('http://example.com')
+
+    def parse(self, response):
+        self.category = 'books'
+        yield Request('http://example2.com/a')
+        yield Request('http://example2.com/b')
+        yield Request('http://example3.com/a')
+
+
+class TestSpider6(TestSpider):
+
+    def parse(self, response):
+        self.success = True
+        yield Request('http://example2.com', callback=self.parse2, meta=response.meta)
+
+
 class TestDownloadHandler:
 
     results = []
@@ -251,6 +307,93 @@ class FronteraSchedulerTest(TestCase):
             self.assertTrue(crawler.spider.success)
             self.assertTrue(crawler.spider.success2)
 
+    @defer.inlineCallbacks
+    def test_record_and_replay(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        record_file = os.path.join(tmp_dir, 'recording.gz')
+        crawlers = []
+        for backend_settings in [
+            {'FRONTERA_SCHEDULER_RECORD_FILE': record_file},
+            {'BACKEND': 'scrapy_frontera.components.backends.ReplayBackend', 'REPLAY_BACKEND_FILE': record_file},
+        ]:
+            with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+                mocked_handler.return_value = TestDownloadHandler()
+                mocked_handler.return_value.set_results([Response(url='http://example.com'),
+                                                         Response(url='http://example2.com')])
+
+                settings = Settings()
+                settings.setdict(TEST_SETTINGS, priority='cmdline')
+                settings.setdict(dict(backend_settings, **{
+                    'FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER': True,
+                    'FRONTERA_SCHEDULER_REQUEST_CALLBACKS_TO_FRONTIER': ['parse2'],
+                }))
+                crawler = get_crawler(TestSpider2, settings)
+                crawlers.append(crawler)
+
+                yield self.runner.crawl(crawler)
+                self.assertTrue(crawler.spider.success)
+                self.assertTrue(crawler.spider.success2)
+
+        calls = list(read_recording(record_file))
+        self.assertEqual(crawlers[0].stats.get_value('scrapyfrontera/recorded_calls_count'), len(calls))
+        self.assertEqual([call.method for call in calls if call.method != 'get_next_requests'],
+                         ['add_seeds', 'page_crawled', 'links_extracted', 'page_crawled'])
+        self.assertEqual([[r.url for r in call.result] for call in calls if call.result],
+                         [['http://example.com'], ['http://example2.com']])
+
+    @defer.inlineCallbacks
+    def test_prefetch_doesnt_block_writes(self):
+        crawler = get_crawler(TestSpider2, Settings({
+            'BACKEND': 'frontera.contrib.backends.memory.FIFO',
+            'FRONTERA_SCHEDULER_PREFETCH': True,
+        }))
+        spider = TestSpider2.from_crawler(crawler)
+        frontier = ScrapyFrontierManager(ScrapySettingsAdapter(crawler.settings))
+        frontier.set_spider(spider)
+        page_crawled_threads = []
+
+        def slow_get_next_requests(*args, **kwargs):
+            time.sleep(0.5)
+            return []
+
+        with patch.object(frontier.manager, 'get_next_requests', side_effect=slow_get_next_requests), \
+                patch.object(frontier.manager, 'page_crawled',
+                             side_effect=lambda r: page_crawled_threads.append(threading.current_thread())):
+            dfd = frontier.get_next_requests_in_thread()
+            start = time.time()
+            frontier.page_crawled(Response('http://example.com', request=Request('http://example.com')))
+            self.assertLess(time.time() - start, 0.1)
+            self.assertTrue(frontier.calling)
+            yield dfd
+            yield frontier.stop()
+        # sent from the worker thread, after the read
+        self.assertEqual(len(page_crawled_threads), 1)
+        self.assertIsNot(page_crawled_threads[0], threading.current_thread())
+
+    def test_recording_from_threads(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        record_file = os.path.join(tmp_dir, 'recording.gz')
+        recorder = FrontierRecorder(record_file)
+
+        def record(slot):
+            for i in range(200):
+                recorder.finish(recorder.start('request_error', (i, 'x' * 1000), slot), result=i)
+
+        workers = [threading.Thread(target=record, args=(slot,)) for slot in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        recorder.close()
+        recorder.finish(recorder.start('request_error', (0, 'error')))
+        calls = list(read_recording(record_file))
+        self.assertEqual(recorder.count, 800)
+        self.assertEqual(len(calls), 800)
+        for slot in range(4):
+            self.assertEqual([call.result for call in calls if call.consumer_slot == slot], list(range(200)))
+
     @defer.inlineCallbacks
     def test_start_requests_to_frontier_ii(self):
         with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
@@ -330,3 +473,803 @@ class FronteraSchedulerTest(TestCase):
                 self.assertFalse(crawler.spider.success2)
                 self.assertTrue(crawler.spider.error)
                 self.assertEqual(mocked_schedule.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_start_requests_to_frontier_with_prefetch(self):
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com'),
+                                                     Response(url='http://example2.com')])
+
+            settings = Settings()
+            settings.setdict(TEST_SETTINGS, priority='cmdline')
+            settings.setdict({
+                'FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER': True,
+                'FRONTERA_SCHEDULER_PREFETCH': True,
+            })
+            crawler = get_crawler(TestSpider, settings)
+
+            yield self.runner.crawl(crawler)
+            self.assertTrue(crawler.spider.success)
+            self.assertTrue(crawler.spider.success2)
+            self.assertEqual(crawler.stats.get_value('scrapyfrontera/prefetch_count'), 1)
+
+    @defer.inlineCallbacks
+    def test_start_requests_to_frontier_with_lazy_disk_queue(self):
+        jobdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, jobdir)
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com'),
+                                                     Response(url='http://example2.com')])
+
+            settings = Settings()
+            settings.setdict(TEST_SETTINGS, priority='cmdline')
+            settings.setdict({
+                'JOBDIR': jobdir,
+                'FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER': True,
+                'FRONTERA_SCHEDULER_LAZY_DISK_QUEUE': True,
+            })
+            crawler = get_crawler(TestSpider, settings)
+
+            yield self.runner.crawl(crawler)
+            self.assertTrue(crawler.spider.success)
+            self.assertTrue(crawler.spider.success2)
+            self.assertEqual(crawler.stats.get_value('scrapyfrontera/lazy_queue_pushed_count'), 1)
+            self.assertEqual(crawler.stats.get_value('scrapyfrontera/returned_requests_count'), 1)
+
+    @defer.inlineCallbacks
+    def test_start_requests_to_frontier_with_background_start(self):
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com'),
+                                                     Response(url='http://example2.com')])
+
+            settings = Settings()
+            settings.setdict(TEST_SETTINGS, priority='cmdline')
+            settings.setdict({
+                'FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER': True,
+                'FRONTERA_SCHEDULER_BACKGROUND_START': True,
+            })
+            crawler = get_crawler(TestSpider, settings)
+
+            yield self.runner.crawl(crawler)
+            self.assertTrue(crawler.spider.success)
+            self.assertTrue(crawler.spider.success2)
+            stats = crawler.stats.get_stats()
+            self.assertEqual(stats['scrapyfrontera/init_queued_calls_count'], 1)
+            self.assertIn('scrapyfrontera/init_time', stats)
+            self.assertIn('scrapyfrontera/time_to_first_request', stats)
+
+    @defer.inlineCallbacks
+    def test_return_requests_on_close(self):
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com')])
+
+            settings = Settings()
+            settings.setdict(TEST_SETTINGS, priority='cmdline')
+            settings.setdict({
+                'FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER': True,
+                'FRONTERA_SCHEDULER_RETURN_REQUESTS_ON_CLOSE': True,
+                'CLOSESPIDER_PAGECOUNT': 1,
+                'CONCURRENT_REQUESTS': 1,
+            })
+            crawler = get_crawler(TestSpider5, settings)
+            with patch.object(TestSpider5, 'start_requests', return_value=[
+                Request('http://example.com'), Request('http://example2.com/a'), Request('http://example2.com/b'),
+            ]), patch.object(FIFO, 'add_seeds', autospec=True, side_effect=FIFO.add_seeds) as mocked_add_seeds:
+                yield self.runner.crawl(crawler)
+            self.assertEqual(crawler.stats.get_value('scrapyfrontera/returned_on_close_count'), 2)
+            self.assertEqual(mocked_add_seeds.call_count, 2)
+            self.assertEqual(len(mocked_add_seeds.call_args[0][1]), 2)
+
+    @defer.inlineCallbacks
+    def test_start_requests_to_frontier_with_async_backend(self):
+        for backend_settings in [
+            {'BACKEND': 'scrapy_frontera.components.backends.AsyncMemoryBackend'},
+            {'BACKEND': 'scrapy_frontera.components.backends.AsyncMemoryBackend', 'ASYNC_MEMORY_BACKEND_DELAY': 0.1,
+             'ASYNC_MEMORY_BACKEND_COROUTINES': True},
+            {'FRONTERA_SCHEDULER_ASYNC_BACKEND': True, 'FRONTERA_SCHEDULER_ASYNC_BACKEND_THREADS': 2},
+        ]:
+            with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+                mocked_handler.return_value = TestDownloadHandler()
+                mocked_handler.return_value.set_results([Response(url='http://example.com'),
+                                                         Response(url='http://example2.com')])
+
+                settings = Settings()
+                settings.setdict(TEST_SETTINGS, priority='cmdline')
+                settings.setdict({
+                    'FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER': True,
+                    'FRONTERA_SCHEDULER_STATS_TIMING': True,
+                })
+                settings.setdict(backend_settings)
+                crawler = get_crawler(TestSpider, settings)
+
+                yield self.runner.crawl(crawler)
+                self.assertTrue(crawler.spider.success)
+                self.assertTrue(crawler.spider.success2)
+                stats = crawler.stats.get_stats()
+                self.assertEqual(stats['scrapyfrontera/timing/backend/add_seeds/count'], 1)
+                self.assertEqual(stats['scrapyfrontera/timing/backend/page_crawled/count'], 2)
+
+    @defer.inlineCallbacks
+    def test_callback_requests_to_frontier_with_links_buffer(self):
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com')])
+
+            with patch('frontera.contrib.backends.memory.MemoryDequeQueue.schedule') as mocked_schedule:
+                mocked_schedule.return_value = None
+                settings = Settings()
+                settings.setdict(TEST_SETTINGS, priority='cmdline')
+                settings.setdict({
+                    'FRONTERA_SCHEDULER_REQUEST_CALLBACKS_TO_FRONTIER': ['parse2'],
+                    'FRONTERA_SCHEDULER_LINKS_BUFFER_SIZE': 1000,
+                })
+                crawler = get_crawler(TestSpider2, settings)
+
+                yield self.runner.crawl(crawler)
+                self.assertTrue(crawler.spider.success)
+                self.assertFalse(crawler.spider.success2)
+                self.assertEqual(mocked_schedule.call_count, 1)
+                self.assertEqual(crawler.stats.get_value('scrapyfrontera/links_flush_count'), 1)
+                self.assertEqual(crawler.stats.get_value('scrapyfrontera/links_flushed_count'), 1)
+
+    @defer.inlineCallbacks
+    def test_page_crawled_frontier_only(self):
+        job_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_dir)
+        # with JOBDIR, requests read from the frontier go through scrapy disk queues
+        for job_settings in [{}, {'JOBDIR': job_dir}]:
+            with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+                mocked_handler.return_value = TestDownloadHandler()
+                mocked_handler.return_value.set_results([Response(url='http://example.com', body=b'body'),
+                                                         Response(url='http://example2.com')])
+
+                with patch('frontera.contrib.backends.CommonBackend.page_crawled') as mocked_page_crawled:
+                    mocked_page_crawled.return_value = None
+                    settings = Settings()
+                    settings.setdict(TEST_SETTINGS, priority='cmdline')
+                    settings.setdict(dict(job_settings, **{
+                        'FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER': True,
+                        'FRONTERA_SCHEDULER_PAGE_CRAWLED_FRONTIER_ONLY': True,
+                        'FRONTERA_SCHEDULER_PAGE_CRAWLED_SKIP_BODY': True,
+                    }))
+                    # requests reusing the meta of a frontier response are not reported
+                    crawler = get_crawler(TestSpider6, settings)
+
+                    yield self.runner.crawl(crawler)
+                    self.assertTrue(crawler.spider.success)
+                    self.assertTrue(crawler.spider.success2)
+                    self.assertEqual(mocked_page_crawled.call_count, 1)
+                    frontier_response = mocked_page_crawled.call_args[0][0]
+                    self.assertEqual(frontier_response.url, 'http://example.com')
+                    self.assertEqual(frontier_response.body, b'')
+                    self.assertEqual(frontier_response.request.meta[b'frontier_fingerprint'],
+                                     request_fingerprint(Request('http://example.com')))
+
+    def test_frontier_origin(self):
+        spider = TestSpider.from_crawler(get_crawler(TestSpider))
+        converter = RequestConverter(spider)
+        frontier_request = converter.to_frontier(Request('http://example.com', callback=spider.parse2))
+        frontier_request.meta[b'frontier_fingerprint'] = 'custom'
+        request = converter.from_frontier(frontier_request)
+        # as if it went through a disk queue
+        request = request_from_dict(request_to_dict(request, spider), spider)
+        self.assertTrue(converter.is_from_frontier(request))
+        self.assertEqual(converter.fingerprint(request), 'custom')
+        self.assertTrue(converter.is_from_frontier(request.replace(dont_filter=True)))
+        redirected = request.replace(url='http://example2.com')
+        self.assertFalse(converter.is_from_frontier(redirected))
+        self.assertNotEqual(converter.fingerprint(redirected), 'custom')
+
+    @defer.inlineCallbacks
+    def test_start_requests_to_frontier_in_background_chunks(self):
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com'),
+                                                     Response(url='http://example2.com')])
+
+            settings = Settings()
+            settings.setdict(TEST_SETTINGS, priority='cmdline')
+            settings.setdict({
+                'FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER': True,
+                'FRONTERA_SCHEDULER_SEEDS_CHUNK_SIZE': 1,
+                'FRONTERA_SCHEDULER_SEEDS_IN_BACKGROUND': True,
+            })
+            crawler = get_crawler(TestSpider, settings)
+
+            yield self.runner.crawl(crawler)
+            self.assertTrue(crawler.spider.success)
+            self.assertTrue(crawler.spider.success2)
+            self.assertEqual(crawler.stats.get_value('scrapyfrontera/seeds_count'), 1)
+            self.assertEqual(crawler.stats.get_value('scrapyfrontera/seeds_chunks_count'), 1)
+
+    def test_frontier_activity_does_not_block_reads(self):
+        crawler = get_crawler(TestSpider, Settings(TEST_SETTINGS))
+        scheduler = FronteraScheduler.from_crawler(crawler)
+        scheduler.frontier = Mock(starting=False, seeding=True, converting=False, calling=False)
+        with patch.object(Scheduler, 'has_pending_requests', return_value=False):
+            self.assertFalse(scheduler._has_pending_requests())
+            self.assertTrue(scheduler.has_pending_requests())
+            scheduler.frontier.seeding = False
+            self.assertFalse(scheduler.has_pending_requests())
+            scheduler.frontier.calling = True
+            self.assertFalse(scheduler._has_pending_requests())
+            self.assertTrue(scheduler.has_pending_requests())
+            scheduler.frontier.calling = False
+            scheduler.frontier.converting = True
+            self.assertFalse(scheduler._has_pending_requests())
+            self.assertTrue(scheduler.has_pending_requests())
+
+    def test_return_requests_keeps_other_requests(self):
+        crawler = get_crawler(TestSpider, Settings(TEST_SETTINGS))
+        scheduler = FronteraScheduler.from_crawler(crawler)
+        frontier_request, other_request = Request('http://example.com'), Request('http://example2.com')
+        scheduler.frontier = Mock()
+        scheduler.frontier.request_converter.is_from_frontier.side_effect = lambda r: r is frontier_request
+        scheduler.mqs = Mock()
+        scheduler.mqs.pop.side_effect = [other_request, frontier_request, None]
+        scheduler.slot_buffer = None
+        with patch.object(scheduler, '_mqpush') as mocked_mqpush:
+            scheduler._return_requests()
+        scheduler.frontier.return_requests.assert_called_once_with([frontier_request])
+        mocked_mqpush.assert_called_once_with(other_request)
+
+    @defer.inlineCallbacks
+    def test_links_dedup(self):
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com')])
+
+            with patch('frontera.contrib.backends.memory.MemoryDequeQueue.schedule') as mocked_schedule:
+                mocked_schedule.return_value = None
+                settings = Settings()
+                settings.setdict(TEST_SETTINGS, priority='cmdline')
+                settings.setdict({
+                    'FRONTERA_SCHEDULER_REQUEST_CALLBACKS_TO_FRONTIER': ['parse'],
+                    'FRONTERA_SCHEDULER_LINKS_DEDUP_CAPACITY': 1000,
+                })
+                crawler = get_crawler(TestSpider4, settings)
+
+                yield self.runner.crawl(crawler)
+                self.assertEqual(crawler.spider.success, 1)
+                self.assertEqual(crawler.stats.get_value('scrapyfrontera/links_extracted_count'), 3)
+                self.assertEqual(crawler.stats.get_value('scrapyfrontera/links_dedup_suppressed_count'), 1)
+
+    @defer.inlineCallbacks
+    def test_links_converted_in_thread(self):
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com')])
+
+            with patch('frontera.contrib.backends.memory.MemoryDequeQueue.schedule') as mocked_schedule:
+                mocked_schedule.return_value = None
+                settings = Settings()
+                settings.setdict(TEST_SETTINGS, priority='cmdline')
+                settings.setdict({
+                    'FRONTERA_SCHEDULER_REQUEST_CALLBACKS_TO_FRONTIER': ['parse'],
+                    'FRONTERA_SCHEDULER_CONVERT_IN_THREAD_THRESHOLD': 2,
+                })
+                crawler = get_crawler(TestSpider4, settings)
+
+                yield self.runner.crawl(crawler)
+                self.assertEqual(crawler.spider.success, 1)
+                self.assertEqual(crawler.stats.get_value('scrapyfrontera/links_converted_in_thread_count'), 3)
+                self.assertEqual(mocked_schedule.call_count, 1)
+
+    def test_overused_slots_tracker(self):
+        crawler = get_crawler(TestSpider)
+        crawler.engine = Mock()
+        crawler.engine.downloader.slots = {
+            'example.com': Mock(active={1, 2, 3}, concurrency=2),
+            'example2.com': Mock(active={1}, concurrency=2),
+        }
+        tracker = OverusedSlotsTracker(crawler, 1.0)
+        self.assertEqual(tracker.get_overused_keys(), [])
+        for key in crawler.engine.downloader.slots:
+            tracker._slot_activity(Request('http://' + key, meta={'download_slot': key}), None)
+        self.assertEqual(tracker.get_overused_keys(), ['example.com'])
+        crawler.engine.downloader.slots['example.com'].active = {1}
+        self.assertEqual(tracker.get_overused_keys(), [])
+
+    def test_slot_buffer(self):
+        crawler = get_crawler(TestSpider)
+        crawler.engine = Mock()
+        crawler.engine.downloader.slots = {
+            'example.com': Mock(active={1, 2, 3}, concurrency=2),
+        }
+        crawler.engine.downloader._get_slot_key = lambda request, spider: request.meta['download_slot']
+        slot_buffer = SlotBuffer(OverusedSlotsTracker(crawler, 1.0), 2, crawler.stats)
+        requests = [Request('http://example.com/%d' % i, meta={'download_slot': 'example.com'}) for i in range(3)]
+        self.assertFalse(slot_buffer.hold(Request('http://example2.com', meta={'download_slot': 'example2.com'})))
+        self.assertEqual([slot_buffer.hold(request) for request in requests], [True, True, False])
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/slot_buffer/example.com'), 2)
+        self.assertEqual(slot_buffer.release(), [])
+        crawler.engine.downloader.slots['example.com'].active = {1}
+        # slots are only checked after activity
+        self.assertEqual(slot_buffer.release(), [])
+        slot_buffer.tracker._slot_activity(requests[0], None)
+        self.assertEqual(slot_buffer.release(), requests[:1])
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/slot_buffer/example.com'), 1)
+        crawler.engine.downloader.slots = {}
+        self.assertEqual(slot_buffer.release(), requests[1:2])
+        self.assertEqual(len(slot_buffer), 0)
+        self.assertNotIn('scrapyfrontera/slot_buffer/example.com', crawler.stats.get_stats())
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/slot_buffer_size'), 0)
+
+    @defer.inlineCallbacks
+    def test_stats_timing(self):
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com'),
+                                                     Response(url='http://example2.com')])
+
+            settings = Settings()
+            settings.setdict(TEST_SETTINGS, priority='cmdline')
+            settings.setdict({
+                'FRONTERA_SCHEDULER_START_REQUESTS_TO_FRONTIER': True,
+                'FRONTERA_SCHEDULER_STATS_TIMING': True,
+            })
+            crawler = get_crawler(TestSpider, settings)
+
+            yield self.runner.crawl(crawler)
+            self.assertTrue(crawler.spider.success2)
+            stats = crawler.stats.get_stats()
+            self.assertEqual(stats['scrapyfrontera/timing/backend/add_seeds/count'], 1)
+            self.assertEqual(stats['scrapyfrontera/timing/backend/page_crawled/count'], 2)
+            self.assertIn('scrapyfrontera/timing/backend/get_next_requests/p95', stats)
+            self.assertEqual(stats['scrapyfrontera/batch_returned_count'], 1)
+            self.assertEqual(stats['scrapyfrontera/size/scrapy_meta/count'], 3)
+
+    def test_adaptive_batch_size(self):
+        batch_size = AdaptiveBatchSize(min_size=10, max_size=1000, target_seconds=10, smoothing=1)
+        self.assertEqual(batch_size.next_size(queue_depth=0), 10)
+        batch_size._last_time -= 1
+        for _ in range(20):
+            batch_size.request_dequeued()
+        batch_size.backend_called(2)
+        # about 20 requests/s during 12 seconds
+        self.assertTrue(195 <= batch_size.next_size(queue_depth=40) <= 205)
+        batch_size._last_time -= 1
+        for _ in range(1000):
+            batch_size.request_dequeued()
+        self.assertEqual(batch_size.next_size(queue_depth=0), 1000)
+
+    def test_consumer_slots(self):
+        slots = ConsumerSlots(['0', '1', '2'], backoff=60)
+        self.assertEqual(slots.allocate(10), [('0', 4), ('1', 3), ('2', 3)])
+        self.assertEqual(slots.allocate(10), [('1', 4), ('2', 3), ('0', 3)])
+        self.assertEqual(slots.allocate(2), [('2', 1), ('0', 1)])
+        slots.record('1', 4, 0)
+        self.assertEqual(slots.available_slots(), ['0', '2'])
+
+        slots = ConsumerSlots(['0', '1'], policy='backlog', smoothing=1)
+        slots.record('0', 10, 10)
+        slots.record('1', 10, 2)
+        self.assertEqual(slots.allocate(12), [('0', 10), ('1', 2)])
+        self.assertRaises(ValueError, ConsumerSlots, ['0'], policy='unknown')
+
+    def test_consumer_slots_manager(self):
+        crawler = get_crawler(TestSpider2, Settings({
+            'BACKEND': 'frontera.contrib.backends.memory.FIFO',
+            'FRONTERA_SCHEDULER_CONSUMER_SLOTS': ['0', '1'],
+        }))
+        spider = TestSpider2.from_crawler(crawler)
+        frontier = ScrapyFrontierManager(ScrapySettingsAdapter(crawler.settings))
+        frontier.set_spider(spider)
+        self.assertEqual(frontier.slot_managers['1'].settings.get('HCF_CONSUMER_SLOT'), '1')
+        frontier.slot_managers['1'].add_seeds([frontier.request_converter.to_frontier(Request('http://example.com'))])
+
+        requests = frontier.get_next_requests(max_next_requests=10)
+        self.assertEqual([r.url for r in requests], ['http://example.com'])
+        self.assertEqual(requests[0].meta['frontier_consumer_slot'], '1')
+        self.assertEqual(frontier.consumer_slots.available_slots(), ['1'])
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/consumer_slot/0/backoff_count'), 1)
+        with patch.object(frontier.slot_managers['1'], 'page_crawled') as mocked_page_crawled:
+            frontier.page_crawled(Response(url='http://example.com', request=requests[0]))
+            self.assertEqual(mocked_page_crawled.call_count, 1)
+        frontier.stop()
+
+    def test_return_requests(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        crawler = get_crawler(TestSpider2, Settings({
+            'BACKEND': 'frontera.contrib.backends.memory.FIFO',
+            'FRONTERA_SCHEDULER_RETURN_REQUESTS_FILE': os.path.join(tmp_dir, 'returned'),
+        }))
+        spider = TestSpider2.from_crawler(crawler)
+        frontier = ScrapyFrontierManager(ScrapySettingsAdapter(crawler.settings))
+        frontier.set_spider(spider)
+        seed = Request('http://example.com', dont_filter=True)
+        fingerprint = frontier.request_converter.fingerprint(seed)
+        frontier.add_seeds([seed])
+        requests = frontier.get_next_requests(max_next_requests=10)
+
+        with patch.object(frontier.manager, 'add_seeds') as mocked_add_seeds:
+            frontier.return_requests(requests)
+            self.assertEqual(mocked_add_seeds.call_args[0][0][0].meta[b'frontier_fingerprint'], fingerprint)
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/returned_on_close_count'), 1)
+
+        with patch.object(frontier.manager, 'add_seeds', side_effect=ValueError):
+            frontier.return_requests(requests)
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/returned_on_close_saved_count'), 1)
+
+        # requests which can't be converted don't prevent the others from being returned
+        with patch.object(frontier.manager, 'add_seeds') as mocked_add_seeds:
+            frontier.return_requests([Request('http://example2.com', callback=lambda r: None)] + requests)
+            self.assertEqual([r.url for r in mocked_add_seeds.call_args[0][0]], ['http://example.com'])
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/returned_on_close_failed_count'), 1)
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/returned_on_close_count'), 3)
+        frontier.stop()
+
+        frontier = ScrapyFrontierManager(ScrapySettingsAdapter(crawler.settings))
+        with patch.object(frontier.manager, 'add_seeds') as mocked_add_seeds:
+            frontier.set_spider(spider)
+            self.assertEqual(mocked_add_seeds.call_args[0][0][0].url, 'http://example.com')
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/returned_requests_loaded_count'), 1)
+        self.assertEqual(os.listdir(tmp_dir), [])
+        frontier.stop()
+
+    def test_request_errors_buffer(self):
+        crawler = get_crawler(TestSpider2, Settings({
+            'BACKEND': 'frontera.contrib.backends.memory.FIFO',
+            'FRONTERA_SCHEDULER_ERRORS_BUFFER_SIZE': 2,
+            'FRONTERA_SCHEDULER_REPORTED_ERRORS': ['TimeoutError', 'DNSLookupError'],
+        }))
+        spider = TestSpider2.from_crawler(crawler)
+        frontier = ScrapyFrontierManager(ScrapySettingsAdapter(crawler.settings))
+        frontier.set_spider(spider)
+        with patch.object(frontier.manager, 'request_error') as mocked_request_error:
+            for _ in range(3):
+                frontier.request_error(Request('http://example.com'), 'TimeoutError')
+            frontier.request_error(Request('http://example.com'), 'ValueError')
+            self.assertEqual(mocked_request_error.call_count, 0)
+            self.assertEqual(frontier.pending_writes, 1)
+            frontier.request_error(Request('http://example2.com'), 'DNSLookupError')
+            self.assertEqual(frontier.pending_writes, 0)
+            self.assertEqual(
+                [(call[0][0].url, call[0][0].meta[b'frontier_error_count'], call[0][1])
+                 for call in mocked_request_error.call_args_list],
+                [('http://example.com', 3, 'TimeoutError'), ('http://example2.com', 1, 'DNSLookupError')],
+            )
+        stats = crawler.stats.get_stats()
+        self.assertEqual(stats['scrapyfrontera/request_error/TimeoutError_count'], 3)
+        self.assertEqual(stats['scrapyfrontera/request_error/ValueError_count'], 1)
+        self.assertEqual(stats['scrapyfrontera/request_errors_filtered_count'], 1)
+        self.assertEqual(stats['scrapyfrontera/request_errors_aggregated_count'], 2)
+        self.assertEqual(stats['scrapyfrontera/request_errors_flushed_count'], 2)
+        frontier.stop()
+
+    def test_dont_filter_fingerprint(self):
+        for fast in (False, True):
+            settings = Settings({'FRONTERA_SCHEDULER_FAST_DONT_FILTER_FINGERPRINT': fast})
+            crawler = get_crawler(TestSpider, settings)
+            converter = RequestConverter(TestSpider.from_crawler(crawler))
+            request = Request('http://example.com', dont_filter=True)
+            fingerprint = converter.fingerprint(request)
+            self.assertEqual(len(fingerprint), 40)
+            self.assertEqual(converter.fingerprint(request), fingerprint)
+            self.assertNotEqual(converter.fingerprint(Request('http://example.com', dont_filter=True)), fingerprint)
+            self.assertEqual(converter.fingerprint(Request('http://example.com')),
+                             converter.fingerprint(Request('http://example.com')))
+
+    def test_dynamic_spider_methods(self):
+        settings = Settings({'FRONTERA_SCHEDULER_CALLBACK_SLOT_PREFIX_MAP': {'parse_dynamic': 'myslot/5'}})
+        spider = TestSpider.from_crawler(get_crawler(TestSpider, settings))
+        converter = RequestConverter(spider)
+
+        def parse_dynamic(self, response):
+            pass
+
+        spider.parse_dynamic = types.MethodType(parse_dynamic, spider)
+        frontier_request = converter.to_frontier(Request('http://example.com', callback=spider.parse_dynamic))
+        self.assertEqual(frontier_request.meta[b'scrapy_callback'], b'parse_dynamic')
+        self.assertEqual(frontier_request.meta[b'frontier_slot_prefix'], 'myslot')
+        self.assertEqual(frontier_request.meta[b'frontier_number_of_slots'], 5)
+        self.assertIn(parse_dynamic, converter._method_plans)
+        self.assertEqual(converter.from_frontier(frontier_request).callback, spider.parse_dynamic)
+
+        with self.assertRaises(ValueError):
+            converter.to_frontier(Request('http://example.com/2', callback=lambda response: None))
+        with self.assertRaises(ValueError):
+            converter.to_frontier(Request('http://example.com/3', callback=TestSpider2().parse))
+
+    @defer.inlineCallbacks
+    def test_state_versioning(self):
+        state_store = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_store)
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com')])
+
+            with patch('frontera.contrib.backends.memory.MemoryDequeQueue.schedule') as mocked_schedule:
+                mocked_schedule.return_value = None
+                settings = Settings()
+                settings.setdict(TEST_SETTINGS, priority='cmdline')
+                settings.setdict({
+                    'FRONTERA_SCHEDULER_REQUEST_CALLBACKS_TO_FRONTIER': ['parse'],
+                    'FRONTERA_SCHEDULER_STATE_ATTRIBUTES': ['category'],
+                    'FRONTERA_SCHEDULER_STATE_VERSIONING': True,
+                    'FRONTERA_SCHEDULER_STATE_STORE': state_store,
+                })
+                crawler = get_crawler(TestSpider5, settings)
+
+                yield self.runner.crawl(crawler)
+                frontier_requests = [r[2] for r in mocked_schedule.call_args_list[0][0][0]]
+                self.assertEqual([r.url for r in frontier_requests],
+                                 ['http://example2.com/a', 'http://example2.com/b', 'http://example3.com/a'])
+                self.assertEqual(len({r.meta[b'spider_state_version'] for r in frontier_requests}), 1)
+                self.assertEqual([r.meta.get(b'spider_state') for r in frontier_requests],
+                                 [[('category', 'books')], None, [('category', 'books')]])
+
+        # consumer side
+        settings = Settings({'FRONTERA_SCHEDULER_STATE_ATTRIBUTES': ['category']})
+        consumer_spider = TestSpider5.from_crawler(get_crawler(TestSpider5, settings))
+        converter = RequestConverter(consumer_spider)
+        converter.from_frontier(frontier_requests[1])
+        self.assertIsNone(consumer_spider.category)
+        converter.from_frontier(frontier_requests[0])
+        self.assertEqual(consumer_spider.category, 'books')
+
+        # a consumer sharing the state store resolves versions without embedded state
+        settings = Settings({
+            'FRONTERA_SCHEDULER_STATE_ATTRIBUTES': ['category'],
+            'FRONTERA_SCHEDULER_STATE_STORE': state_store,
+        })
+        consumer_spider = TestSpider5.from_crawler(get_crawler(TestSpider5, settings))
+        RequestConverter(consumer_spider).from_frontier(frontier_requests[1])
+        self.assertEqual(consumer_spider.category, 'books')
+
+    def test_state_versions(self):
+        state_store = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_store)
+        settings = Settings({
+            'FRONTERA_SCHEDULER_STATE_ATTRIBUTES': ['category'],
+            'FRONTERA_SCHEDULER_STATE_VERSIONING': True,
+            'FRONTERA_SCHEDULER_STATE_STORE': state_store,
+        })
+        spider = TestSpider5.from_crawler(get_crawler(TestSpider5, settings))
+        converter = RequestConverter(spider)
+        spider.category = 'books'
+        first, second = converter.to_frontier_many([Request('http://example.com/1'), Request('http://example.com/2')])
+        third = converter.to_frontier_many([Request('http://example.com/3')])[0]
+        self.assertEqual([r.meta.get(b'spider_state') for r in (first, second, third)],
+                         [[('category', 'books')], None, None])
+        version = first.meta[b'spider_state_version']
+        self.assertEqual({second.meta[b'spider_state_version'], third.meta[b'spider_state_version']}, {version})
+
+        self.assertEqual(os.listdir(state_store), ['%s.state' % version])
+
+        # single conversions keep the last snapshot, and follow the per host rule
+        spider.category = 'music'
+        single = converter.to_frontier(Request('http://example.com/4'))
+        self.assertEqual(single.meta[b'spider_state_version'], version)
+        self.assertIsNone(single.meta.get(b'spider_state'))
+        single = converter.to_frontier(Request('http://example2.com/4'))
+        self.assertEqual(single.meta[b'spider_state'], [('category', 'books')])
+
+        fourth, fifth = converter.to_frontier_many([Request('http://example.com/5'), Request('http://example.com/6')])
+        new_version = fourth.meta[b'spider_state_version']
+        self.assertNotEqual(new_version, version)
+        self.assertEqual([r.meta.get(b'spider_state') for r in (fourth, fifth)], [[('category', 'music')], None])
+        self.assertEqual(len(os.listdir(state_store)), 2)
+
+        # explicit refresh
+        spider.category = 'games'
+        converter.refresh_state()
+        single = converter.to_frontier(Request('http://example.com/7'))
+        self.assertNotEqual(single.meta[b'spider_state_version'], new_version)
+        self.assertEqual(single.meta[b'spider_state'], [('category', 'games')])
+        self.assertIsNone(converter.to_frontier(Request('http://example.com/8')).meta.get(b'spider_state'))
+
+    def test_state_versioning_without_store(self):
+        settings = Settings({
+            'FRONTERA_SCHEDULER_STATE_ATTRIBUTES': ['category'],
+            'FRONTERA_SCHEDULER_STATE_VERSIONING': True,
+        })
+        spider = TestSpider5.from_crawler(get_crawler(TestSpider5, settings))
+        spider.category = 'books'
+        converter = RequestConverter(spider)
+        self.assertFalse(converter.state_versioning)
+        requests = [Request('http://example.com/1'), Request('http://example.com/2')]
+        frontier_requests = converter.to_frontier_many(requests)
+        self.assertEqual([r.meta.get(b'spider_state') for r in frontier_requests], [[('category', 'books')]] * 2)
+        self.assertNotIn(b'spider_state_version', frontier_requests[0].meta)
+
+    def test_detached_conversion(self):
+        state_store = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_store)
+        settings = Settings({
+            'FRONTERA_SCHEDULER_STATE_ATTRIBUTES': ['category'],
+            'FRONTERA_SCHEDULER_STATE_VERSIONING': True,
+            'FRONTERA_SCHEDULER_STATE_STORE': state_store,
+            'FRONTERA_SCHEDULER_META_DENYLIST': ['depth'],
+        })
+        crawler = get_crawler(TestSpider5, settings)
+        spider = TestSpider5.from_crawler(crawler)
+        spider.category = 'books'
+        converter = RequestConverter(spider)
+        requests = [Request('http://example.com/1', meta={'depth': 1}), Request('http://example.com/2')]
+        result = converter.to_frontier_many_detached(requests, converter.snapshot())
+        self.assertIsNone(crawler.stats.get_value('scrapyfrontera/meta_pruned_keys_count'))
+        self.assertEqual(len(converter._fingerprints), 0)
+
+        frontier_requests = converter.finish_detached(result)
+        self.assertEqual([r.meta.get(b'spider_state') for r in frontier_requests], [[('category', 'books')], None])
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/meta_pruned_keys_count'), 1)
+        self.assertIsNone(converter.to_frontier_many([Request('http://example.com/3')])[0].meta.get(b'spider_state'))
+
+    def test_meta_pruning(self):
+        settings = Settings({
+            'FRONTERA_SCHEDULER_META_DENYLIST': ['download_slot', 'depth'],
+            'FRONTERA_SCHEDULER_META_MAX_SIZE': 1000,
+        })
+        crawler = get_crawler(TestSpider, settings)
+        converter = RequestConverter(TestSpider.from_crawler(crawler))
+        meta = {'download_slot': 'example.com', 'depth': 3, 'item': 'x'}
+        frontier_request = converter.to_frontier(Request('http://example.com', meta=meta))
+        self.assertEqual(frontier_request.meta[b'scrapy_meta'], {'item': 'x'})
+        self.assertEqual(len(meta), 3)
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/meta_pruned_keys_count'), 2)
+        self.assertGreater(crawler.stats.get_value('scrapyfrontera/meta_pruned_bytes'), 0)
+
+        converter.to_frontier(Request('http://example.com', meta={'item': 'x' * 2000}))
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/meta_max_size_exceeded_count'), 1)
+
+        settings.set('FRONTERA_SCHEDULER_META_MAX_SIZE_ACTION', 'error')
+        settings.set('FRONTERA_SCHEDULER_META_ALLOWLIST', ['item'])
+        converter = RequestConverter(TestSpider.from_crawler(get_crawler(TestSpider, settings)))
+        frontier_request = converter.to_frontier(Request('http://example.com', meta={'other': 1, 'item': 'x'}))
+        self.assertEqual(frontier_request.meta[b'scrapy_meta'], {'item': 'x'})
+        self.assertRaises(ValueError, converter.to_frontier, Request('http://example.com', meta={'item': 'x' * 2000}))
+
+    def test_payload_codec(self):
+        settings = Settings({
+            'FRONTERA_SCHEDULER_PAYLOAD_CODEC': True,
+            'FRONTERA_SCHEDULER_PAYLOAD_COMPRESS_THRESHOLD': 100,
+        })
+        spider = TestSpider.from_crawler(get_crawler(TestSpider, settings))
+        converter = RequestConverter(spider)
+        request = Request('http://example.com', method='POST', body=b'x' * 1000, callback=spider.parse2,
+                          headers={'Content-Type': 'text/plain'}, cookies={'session': '1'}, meta={'item': 'x'})
+        frontier_request = converter.to_frontier(request)
+        self.assertNotIn(b'scrapy_meta', frontier_request.meta)
+        self.assertIn(b'frontier_fingerprint', frontier_request.meta)
+        self.assertLess(len(frontier_request.meta[b'scrapy_payload']), 500)
+
+        # consumer doesn't need codec setting to decode
+        consumer_spider = TestSpider.from_crawler(get_crawler(TestSpider))
+        scrapy_request = RequestConverter(consumer_spider).from_frontier(frontier_request)
+        self.assertEqual(scrapy_request.body, request.body)
+        self.assertEqual(scrapy_request.callback, consumer_spider.parse2)
+        self.assertEqual(scrapy_request.meta['item'], 'x')
+        self.assertEqual(scrapy_request.headers[b'Content-Type'], b'text/plain')
+        self.assertEqual(scrapy_request.cookies, {'session': '1'})
+
+        # reported responses don't carry meta twice
+        response_converter = ResponseConverter(spider, converter)
+        frontier_response = response_converter.to_frontier(Response('http://example.com', request=request))
+        self.assertNotIn(b'scrapy_meta', frontier_response.request.meta)
+        self.assertIn(b'scrapy_payload', frontier_response.request.meta)
+
+    @defer.inlineCallbacks
+    def test_callback_requests_to_frontier_with_spool(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com')])
+
+            with patch('frontera.contrib.backends.memory.MemoryDequeQueue.schedule') as mocked_schedule:
+                mocked_schedule.return_value = None
+                settings = Settings()
+                settings.setdict(TEST_SETTINGS, priority='cmdline')
+                settings.setdict({
+                    'FRONTERA_SCHEDULER_REQUEST_CALLBACKS_TO_FRONTIER': ['parse2'],
+                    'FRONTERA_SCHEDULER_SPOOL_DIR': spool_dir,
+                })
+                crawler = get_crawler(TestSpider2, settings)
+
+                yield self.runner.crawl(crawler)
+                self.assertTrue(crawler.spider.success)
+                self.assertFalse(crawler.spider.success2)
+                self.assertEqual(mocked_schedule.call_count, 1)
+                self.assertEqual(crawler.stats.get_value('scrapyfrontera/spool_written_count'), 1)
+                self.assertEqual(crawler.stats.get_value('scrapyfrontera/spool_drained_count'), 1)
+                self.assertEqual(crawler.stats.get_value('scrapyfrontera/spool_depth'), 0)
+                self.assertEqual(os.listdir(spool_dir), [])
+
+    def test_spool_replay(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        spool = FrontierSpool(spool_dir, segment_size=2)
+        for i in range(3):
+            spool.append(('request_error', (i, 'error')))
+        self.assertEqual(spool.depth, 3)
+        spool.close()
+
+        spool = FrontierSpool(spool_dir, segment_size=2)
+        self.assertEqual(spool.depth, 3)
+        name, records = spool.next_segment()
+        self.assertEqual(records, [('request_error', (0, 'error')), ('request_error', (1, 'error'))])
+        spool.ack(name)
+        spool.append(('request_error', (3, 'error')))
+        name, records = spool.next_segment()
+        self.assertEqual(records, [('request_error', (2, 'error'))])
+        spool.ack(name)
+        name, records = spool.next_segment()
+        self.assertEqual(records, [('request_error', (3, 'error'))])
+        spool.ack(name)
+        self.assertEqual(spool.depth, 0)
+        self.assertEqual(spool.next_segment(), (None, []))
+
+    @defer.inlineCallbacks
+    def test_spool_drain(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        crawler = get_crawler(TestSpider2, Settings({
+            'BACKEND': 'frontera.contrib.backends.memory.FIFO',
+            'FRONTERA_SCHEDULER_SPOOL_DIR': spool_dir,
+            'FRONTERA_SCHEDULER_SPOOL_SEGMENT_SIZE': 1,
+            'FRONTERA_SCHEDULER_SPOOL_DRAIN_INTERVAL': 60,
+        }))
+        spider = TestSpider2.from_crawler(crawler)
+        frontier = ScrapyFrontierManager(ScrapySettingsAdapter(crawler.settings))
+        frontier.set_spider(spider)
+        with patch.object(frontier.manager, 'add_seeds') as mocked_add_seeds:
+            for i in range(3):
+                frontier.add_seeds([Request('http://example.com/%d/%d' % (i, j)) for j in range(2)])
+            # pending writes count seeds, not spooled calls
+            self.assertEqual(frontier.spool.depth, 3)
+            self.assertEqual(frontier.pending_writes, 6)
+            # a single drain sends all segments
+            frontier._drain_spool()
+            drained = frontier._spool_draining
+            frontier._drain_spool()
+            self.assertIs(frontier._spool_draining, drained)
+            yield drained
+            self.assertEqual(mocked_add_seeds.call_count, 3)
+            self.assertEqual(frontier.spool.depth, 0)
+            self.assertEqual(frontier.pending_writes, 0)
+
+            # closing waits for the segment being drained, and sends the rest
+            for i in range(3):
+                frontier.add_seeds([Request('http://example.com/%d' % i)])
+            frontier._drain_spool()
+            dfd = frontier.stop()
+            self.assertIsNotNone(dfd)
+            yield dfd
+            self.assertEqual(mocked_add_seeds.call_count, 6)
+        self.assertEqual(crawler.stats.get_value('scrapyfrontera/spool_drained_count'), 6)
+        self.assertEqual(frontier.pending_writes, 0)
+        self.assertEqual(os.listdir(spool_dir), [])
+
+    @defer.inlineCallbacks
+    def test_backpressure(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        with patch('scrapy.core.downloader.handlers.http11.HTTP11DownloadHandler') as mocked_handler:
+            mocked_handler.return_value = TestDownloadHandler()
+            mocked_handler.return_value.set_results([Response(url='http://example.com')])
+
+            with patch('frontera.contrib.backends.memory.MemoryDequeQueue.schedule') as mocked_schedule:
+                mocked_schedule.return_value = None
+                settings = Settings()
+                settings.setdict(TEST_SETTINGS, priority='cmdline')
+                settings.setdict({
+                    'FRONTERA_SCHEDULER_REQUEST_CALLBACKS_TO_FRONTIER': ['parse2'],
+                    'FRONTERA_SCHEDULER_SPOOL_DIR': spool_dir,
+                    'FRONTERA_SCHEDULER_SPOOL_DRAIN_INTERVAL': 0.1,
+                    'FRONTERA_SCHEDULER_BACKPRESSURE_HIGH_WATERMARK': 1,
+                    'FRONTERA_SCHEDULER_BACKPRESSURE_INTERVAL': 0.1,
+                })
+                crawler = get_crawler(TestSpider2, settings)
+
+                yield self.runner.crawl(crawler)
+                self.assertTrue(crawler.spider.success)
+                self.assertEqual(mocked_schedule.call_count, 1)
+                self.assertEqual(crawler.stats.get_value('scrapyfrontera/backpressure_pause_count'), 1)
+                self.assertGreater(crawler.stats.get_value('scrapyfrontera/backpressure_pause_time'), 0)
+                self.assertFalse(crawler.engine.paused)